@@ -0,0 +1,369 @@
+#!/usr/bin/env pypy3
+# pyright: basic
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import pickle
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import astuple
+
+try:
+	import tracemalloc
+except ImportError: # e.g. pypy3; allocations are then not reported
+	tracemalloc = None
+
+import optimize as o
+
+BASELINE_FILENAME = 'bench_baseline.json'
+BASELINE_VERSION = 2
+CORPUS_SEED = 1
+CORPUS_WORDS = 2000
+CORPUS_FILES = 8
+CORPUS_FILE_WORDS = 20000
+LAYOUT_SEED = 2
+REFERENCE_LAYOUTS = 32
+POPULATION_SIZE = 200
+MIN_ROUND_TIME = 0.2
+ROUNDS = 5
+TOLERANCE = 0.2
+REL_EPSILON = 1e-9
+
+# rough english letter frequencies, enough to give the synthetic corpus a realistic shape
+LETTER_WEIGHTS = {
+	'e': 12.7, 't': 9.1, 'a': 8.2, 'o': 7.5, 'i': 7.0, 'n': 6.7, 's': 6.3, 'h': 6.1, 'r': 6.0,
+	'd': 4.3, 'l': 4.0, 'c': 2.8, 'u': 2.8, 'm': 2.4, 'w': 2.4, 'f': 2.2, 'g': 2.0, 'y': 2.0,
+	'p': 1.9, 'b': 1.5, 'v': 1.0, 'k': 0.8, 'j': 0.15, 'x': 0.15, 'q': 0.1, 'z': 0.07,
+}
+
+def make_corpus(path):
+	# a seeded vocabulary drawn with zipf frequencies, written as prose, a readme and commented source
+	rng = random.Random(CORPUS_SEED)
+	letters = list(LETTER_WEIGHTS)
+	weights = list(LETTER_WEIGHTS.values())
+	vocabulary = [''.join(rng.choices(letters, weights, k=rng.randint(1, 9))) for _ in range(CORPUS_WORDS)]
+	ranks = [1 / (i + 1) for i in range(CORPUS_WORDS)]
+
+	files = []
+	for i in range(CORPUS_FILES):
+		words = rng.choices(vocabulary, ranks, k=CORPUS_FILE_WORDS)
+		lines = [' '.join(words[j:j+12]) for j in range(0, len(words), 12)]
+		if i % 4 == 0:
+			name, text = f'doc{i}.txt', '\n'.join(lines)
+		elif i % 4 == 1:
+			name, text = f'readme{i}.md', '# ' + '\n\n'.join(lines)
+		elif i % 4 == 2:
+			name, text = f'src{i}.c', '\n'.join(f'int x{j} = {j}; /* {l} */' for j, l in enumerate(lines))
+		else:
+			name, text = f'src{i}.py', '\n'.join(f'x{j} = "{l[:8]}"  # {l}' for j, l in enumerate(lines))
+		file_path = os.path.join(path, name)
+		with open(file_path, 'w', encoding='utf-8') as f:
+			f.write(text)
+		files.append(file_path)
+	return files
+
+def analyze_corpus(files, result_path):
+	counter = o.NgramCounter()
+	for file in files:
+		o.analyze_target_single(file, counter)
+	o.apply_cutoffs(*counter.to_counters())
+	o.save_analyze_result(result_path, 'bench')
+
+def corpus_key():
+	# the fixture's counts alone, so a change to the scorer is caught by the reference scores
+	h = hashlib.sha256()
+	for counter in (o.LETTERS, o.BIGRAMS, o.TRIGRAMS):
+		h.update(repr(sorted(counter.items())).encode())
+	return h.hexdigest()
+
+def random_layouts(n, seed):
+	random.seed(seed)
+	return [o.make_random() for _ in range(n)]
+
+def random_swaps(n, seed):
+	rng = random.Random(seed)
+	keys = range(o.ROWS * o.COLS)
+	return [tuple(rng.sample(keys, 2)) for _ in range(n)]
+
+def close(a, b):
+	return all(math.isclose(x, y, rel_tol=REL_EPSILON, abs_tol=REL_EPSILON) for x, y in zip(a, b))
+
+def reference_score(layout):
+	# calc_scores straight from the corpus counts and the weight functions, without the compiled tables
+	pos = {ch: (r * o.COLS) + c for r, row in enumerate(layout.letters) for c, ch in enumerate(row) if ch}
+	score = o.Score()
+	left_usage = 0
+	right_usage = 0
+	for ch, count in o.LETTERS.items():
+		if ch not in pos:
+			continue
+		r, c = divmod(pos[ch], o.COLS)
+		score.effort += count * o.EFFORT_GRID[r][c]
+		if c < 5:
+			left_usage += count
+		else:
+			right_usage += count
+	for bg, count in o.BIGRAMS.items():
+		if all(ch in pos for ch in bg):
+			vowels = sum(ch in o.VOWELS for ch in bg)
+			sfb, rolling, scissors = o.bigram_weights(pos[bg[0]], pos[bg[1]], vowels)
+			score.sfb += count * sfb
+			score.rolling += count * rolling
+			score.scissors += count * scissors
+	for tg, count in o.TRIGRAMS.items():
+		if all(ch in pos for ch in tg):
+			vowels = sum(ch in o.VOWELS for ch in tg)
+			sfb, rolling = o.trigram_weights(pos[tg[0]], pos[tg[1]], pos[tg[2]], vowels)
+			score.sfb += count * sfb
+			score.rolling += count * rolling
+	return score, left_usage, right_usage
+
+def check_equivalence(reference):
+	failures = []
+	layouts = random_layouts(REFERENCE_LAYOUTS, LAYOUT_SEED)
+	scores = [astuple(l.score) for l in layouts]
+
+	for i, l in enumerate(layouts):
+		score, left_usage, right_usage = reference_score(l)
+		if not close(scores[i], astuple(score)) or (left_usage, right_usage) != (l.left_usage, l.right_usage):
+			failures.append(f'calc_scores {scores[i]} differs from the per-ngram weights {astuple(score)} on layout {i}')
+			break
+
+	if o.np is not None:
+		positions = [l.pos for l in layouts]
+		effort, sfb, rolling, scissors, left, right = o.batch_scores(positions)
+		for i, l in enumerate(layouts):
+			if not close(scores[i], (effort[i], sfb[i], rolling[i], scissors[i])) or \
+					(left[i], right[i]) != (l.left_usage, l.right_usage):
+				failures.append(f'batch_scores differs from calc_scores on layout {i}')
+				break
+
+	for i, l in enumerate(layouts):
+		work = l.clone()
+		for a, b in random_swaps(50, i):
+			predicted = work.swap_delta(a, b)
+			actual = work.swap(a, b)
+			if abs(predicted - actual) > 1:
+				failures.append(f'swap_delta {predicted} != swap {actual} on layout {i}')
+				break
+		fresh = o.Layout(work.letters)
+		if not close(astuple(work.score), astuple(fresh.score)) or \
+				(work.left_usage, work.right_usage) != (fresh.left_usage, fresh.right_usage):
+			failures.append(f'swap drifted from calc_scores on layout {i}')
+		if astuple(l.score) != scores[i]:
+			failures.append(f'swapping a clone changed the original layout {i}')
+
+	for i, l in enumerate(layouts):
+		if astuple(pickle.loads(pickle.dumps(l)).score) != scores[i]:
+			failures.append(f'pickling changed the score of layout {i}')
+			break
+
+	if reference is not None:
+		if len(reference) != len(scores):
+			failures.append('reference scores are for a different number of layouts')
+		differ = [i for i, (a, b) in enumerate(zip(scores, reference)) if not close(a, b)]
+		if differ:
+			i = differ[0]
+			failures.append(f'{len(differ)} of {len(scores)} layouts score differently from the baseline, '
+				f'e.g. layout {i} {scores[i]}, baseline {tuple(reference[i])}')
+	return scores, failures
+
+def measure(func):
+	# best of ROUNDS, each repeating func until it has run for MIN_ROUND_TIME
+	n = 1
+	while True:
+		start = time.perf_counter()
+		for _ in range(n):
+			func()
+		elapsed = time.perf_counter() - start
+		if elapsed >= MIN_ROUND_TIME:
+			break
+		n *= 2
+	best = elapsed / n
+	for _ in range(ROUNDS - 1):
+		start = time.perf_counter()
+		for _ in range(n):
+			func()
+		best = min(best, (time.perf_counter() - start) / n)
+
+	peak = None
+	if tracemalloc is not None:
+		tracemalloc.start()
+		func()
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	return 1 / best, peak
+
+def cycle(items):
+	it = iter(())
+	def next_item():
+		nonlocal it
+		try:
+			return next(it)
+		except StopIteration:
+			it = iter(items)
+			return next(it)
+	return next_item
+
+def make_benchmarks(result_path, files):
+	layouts = random_layouts(POPULATION_SIZE, LAYOUT_SEED)
+	# score up front so each benchmark times only its own work
+	for l in layouts:
+		l.total
+	next_layout = cycle(layouts)
+	next_swap = cycle(random_swaps(1000, LAYOUT_SEED))
+	next_pair = cycle([(layouts[i], layouts[-i-1]) for i in range(len(layouts))])
+	next_file = cycle(files)
+	work = layouts[0].clone()
+
+	tsv_path = os.path.join(result_path, 'tsv')
+	os.makedirs(tsv_path)
+	shutil.copy(os.path.join(result_path, o.ANALYZE_RESULT_FILENAME), tsv_path)
+
+	def load_tsv():
+		bin_path = os.path.join(tsv_path, o.ANALYZE_BINARY_FILENAME)
+		if os.path.exists(bin_path):
+			os.remove(bin_path)
+		o.load_analysis_result(tsv_path)
+
+	def shuffle():
+		random.seed(LAYOUT_SEED)
+		o.optimize_shuffle(layouts[0], 5, 6)
+
+	benchmarks = {
+		'calc_scores': lambda: next_layout().calc_scores(),
+		'calc_total_score': lambda: next_layout().calc_total_score(),
+		'swap': lambda: work.swap(*next_swap()),
+		'swap_delta': lambda: work.swap_delta(*next_swap()),
+		'clone': lambda: next_layout().clone(),
+		'pickle': lambda: pickle.loads(pickle.dumps(next_layout())),
+		'sort_unique_layouts': lambda: o.sort_unique_layouts(layouts, 50),
+		'crossover': lambda: o.crossover(list(next_pair())),
+		'optimize_shuffle': shuffle,
+		'analyze_target_single': lambda: o.analyze_target_single(next_file()),
+		'load_analysis_result_tsv': load_tsv,
+		'load_analysis_result_bin': lambda: o.load_analysis_result(result_path),
+	}
+	if o.np is not None:
+		positions = [l.pos for l in layouts]
+		benchmarks['batch_scores'] = lambda: o.batch_scores(positions)
+	return benchmarks
+
+def runtime_key():
+	return f'{platform.python_implementation()}-{platform.python_version()}-{"numpy" if o.np is not None else "nonumpy"}'
+
+def load_baseline(file_path):
+	try:
+		with open(file_path, 'r', encoding='utf-8') as f:
+			baseline = json.load(f)
+	except (OSError, ValueError):
+		return {}
+	if baseline.get('version') != BASELINE_VERSION:
+		return {}
+	return baseline
+
+def save_baseline(file_path, baseline):
+	tmp_path = file_path + '.tmp'
+	with open(tmp_path, 'w', encoding='utf-8') as f:
+		json.dump(baseline, f, indent=1, sort_keys=True)
+	os.replace(tmp_path, file_path)
+
+def main():
+	parser = argparse.ArgumentParser(description='micro-benchmarks and score equivalence checks for optimize.py')
+	parser.add_argument('names', nargs='*', metavar='name', help='benchmarks to run (default: all)')
+	parser.add_argument('--baseline', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), BASELINE_FILENAME),
+		help='baseline file, one entry per python implementation')
+	parser.add_argument('--save', action='store_true', help='store this run as the baseline for this python')
+	parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+		help='fail when ops/sec drops or peak allocation grows by more than this fraction')
+	parser.add_argument('--check', action='store_true', help='only run the equivalence checks')
+	parser.add_argument('--update-scores', action='store_true',
+		help='with --save, replace the reference scores after an intended change to the scoring')
+	args = parser.parse_args()
+	if args.update_scores and not args.save:
+		parser.error('--update-scores only applies with --save')
+
+	baseline = load_baseline(args.baseline)
+	key = runtime_key()
+	corpus = baseline.get('corpus')
+	entry = baseline.get('runtimes', {}).get(key, {})
+
+	with tempfile.TemporaryDirectory() as tmp_path:
+		corpus_path = os.path.join(tmp_path, 'corpus')
+		result_path = os.path.join(tmp_path, 'result')
+		os.makedirs(corpus_path)
+		os.makedirs(result_path)
+		files = make_corpus(corpus_path)
+		analyze_corpus(files, result_path)
+		random.seed(LAYOUT_SEED)
+		o.init_score_state()
+
+		key_failures = []
+		fixture_key = corpus_key()
+		if corpus is not None and args.update_scores:
+			corpus = None
+		elif corpus is not None and corpus['key'] != fixture_key:
+			# the fixture itself changed, e.g. the analyzer now counts differently
+			key_failures.append('baseline was recorded on a different synthetic corpus; '
+				'rerun with --save --update-scores if the change is intended')
+			corpus = None
+
+		scores, failures = check_equivalence(corpus['scores'] if corpus else None)
+		failures = key_failures + failures
+		for failure in failures:
+			print(f'FAIL equivalence: {failure}')
+		if not failures:
+			print(f'equivalence ok ({len(scores)} layouts)')
+		if args.check:
+			return 1 if failures else 0
+
+		benchmarks = make_benchmarks(result_path, files)
+		names = args.names or list(benchmarks)
+		unknown = [n for n in names if n not in benchmarks]
+		if unknown:
+			parser.error(f'unknown benchmark {", ".join(unknown)}; choose from {", ".join(benchmarks)}')
+
+		print(f'{key}')
+		print(f'{"benchmark":<28}{"ops/sec":>14}{"us/op":>12}{"peak KiB":>10}{"baseline":>10}')
+		results = {}
+		for name in names:
+			ops, peak = measure(benchmarks[name])
+			results[name] = {'ops': ops, 'peak': peak}
+			status = ''
+			old = entry.get(name)
+			if old:
+				change = ops / old['ops'] - 1
+				status = f'{change*100:+.0f}%'
+				if change < -args.tolerance:
+					failures.append(f'{name} {ops:,.0f} ops/sec, baseline {old["ops"]:,.0f}')
+					status += ' FAIL'
+				elif peak is not None and old['peak'] is not None and peak > old['peak'] * (1 + args.tolerance) + 1024:
+					failures.append(f'{name} peak {peak/1024:,.1f} KiB, baseline {old["peak"]/1024:,.1f} KiB')
+					status += ' FAIL'
+			peak_text = f'{peak/1024:,.1f}' if peak is not None else '-'
+			print(f'{name:<28}{ops:>14,.0f}{1e6/ops:>12,.2f}{peak_text:>10}{status:>10}')
+
+	if args.save:
+		if failures:
+			print('not saving a baseline from a failing run')
+		else:
+			baseline['version'] = BASELINE_VERSION
+			baseline['corpus'] = {'key': fixture_key, 'scores': scores}
+			runtimes = baseline.setdefault('runtimes', {})
+			runtimes[key] = {**runtimes.get(key, {}), **results}
+			save_baseline(args.baseline, baseline)
+			print(f'baseline saved to {args.baseline}')
+
+	for failure in failures:
+		print(f'FAIL {failure}')
+	return 1 if failures else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
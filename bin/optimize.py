@@ -1,24 +1,36 @@
 #!/usr/bin/env pypy3
 # pyright: basic
 
-import shutil
 import subprocess
+import argparse
+import queue
 import string
 import zipfile
-import tempfile
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
 import re
 import math
 import random
 import multiprocessing
 from collections import Counter
+from operator import add
+from itertools import compress
 from ast import literal_eval
 import signal
-from dataclasses import dataclass, field, fields
-import statistics
+import pickle
+from dataclasses import dataclass, field, fields, astuple
+import hashlib
+import mmap
+import struct
 import sys
-from itertools import permutations
+import time
+import heapq
+from array import array
+
+try:
+	import numpy as np
+except ImportError: # e.g. pypy3 without numpy; everything falls back to Layout.calc_scores
+	np = None
 
 @dataclass(slots=True)
 class Score:
@@ -30,166 +42,299 @@ class Score:
 @dataclass(slots=True)
 class Layout:
 	letters: list[list[str]]
-	score: Score = field(default_factory=lambda: Score())
-	total: int = 0
-	left_usage: int = 0
-	right_usage: int = 0
 	source: str = ""
+	canonical: bytes | None = field(default=None, repr=False, compare=False)
+	# scored lazily on first access; None until then
+	_score: Score | None = field(default=None, init=False, repr=False, compare=False)
+	_total: int | None = field(default=None, init=False, repr=False, compare=False)
+	_left_usage: int = field(default=0, init=False, repr=False, compare=False)
+	_right_usage: int = field(default=0, init=False, repr=False, compare=False)
+	_pos: list[int] | None = field(default=None, init=False, repr=False, compare=False)
 
 	def clone(self):
-		return Layout(
-			[row[:] for row in self.letters],
-			source=self.source,
-		)
+		layout = Layout([row[:] for row in self.letters], source=self.source, canonical=self.canonical)
+		score = self._score
+		if score is not None:
+			layout._score = Score(score.effort, score.sfb, score.rolling, score.scissors)
+			layout._total = self._total
+			layout._left_usage = self._left_usage
+			layout._right_usage = self._right_usage
+			layout._pos = self._pos[:]
+		return layout
 
 	def __post_init__(self):
 		self.letters = [r[:] for r in self.letters]
-		self.calc_scores()
-		if SCORE_MEDIAN is not None:
+
+	@property
+	def score(self):
+		if self._score is None:
+			self.calc_scores()
+		return self._score
+
+	@property
+	def total(self):
+		if self._total is None:
+			if SCORE_MEDIAN is None:
+				return 0
 			self.calc_total_score()
+		return self._total
+
+	@property
+	def left_usage(self):
+		if self._score is None:
+			self.calc_scores()
+		return self._left_usage
+
+	@property
+	def right_usage(self):
+		if self._score is None:
+			self.calc_scores()
+		return self._right_usage
+
+	@property
+	def pos(self):
+		if self._score is None:
+			self.calc_scores()
+		return self._pos
 
 	def __eq__(self, other):
 		if not isinstance(other, Layout):
 			return False
-		return self.flatten() == other.flatten() or self.flatten() == other.flatten_reverse()
+		return self.canonical_key() == other.canonical_key()
 
 	def __hash__(self):
-		return hash(tuple(tuple(r) for r in self.letters))
+		return hash(self.canonical_key())
+
+	def __reduce__(self):
+		# what crosses the process boundary: packed letters, precomputed scores, a bounded lineage
+		score = self.score
+		return (unpack_layout, (
+			self.pack(),
+			(score.effort, score.sfb, score.rolling, score.scissors),
+			self.left_usage,
+			self.right_usage,
+			lineage_tail(self.source),
+		))
+
+	def pack(self):
+		# one byte per key, blanks as spaces
+		return ''.join(ch or ' ' for row in self.letters for ch in row).encode()
+
+	def canonical_key(self):
+		# the smaller of the packed layout and its mirror
+		if self.canonical is None:
+			flat = self.pack()
+			self.canonical = min(flat, mirror_key(flat))
+		return self.canonical
 
 	def calc_scores(self):
+		global EVALS
+		EVALS += 1
 		_effort_grid = EFFORT_GRID
-		_finger_grid = FINGER_GRID
-		_bigrams = BIGRAMS
-		_trigrams = TRIGRAMS
-		pos = {}
-
-		sfb = 0
-		rolling = 0
-		scissors = 0
+		pos = [-1] * len(LETTER_COUNTS)
 
-		self.score = Score()
-		self.left_usage = 0
-		self.right_usage = 0
+		score = Score()
+		left_usage = 0
+		right_usage = 0
 
 		for r in range(ROWS):
 			for c in range(COLS):
 				ch = self.letters[r][c]
 				if ch:
-					pos[ch] = (r*COLS) + c
 					try:
-						l = LETTERS[ch]
+						i = LETTER_IDS[ch]
 					except KeyError:
 						print('======= ERROR')
 						print_layout(self)
 						sys.exit(1)
-					self.score.effort += l * _effort_grid[r][c]
+					pos[i] = (r*COLS) + c
+					l = LETTER_COUNTS[i]
+					score.effort += l * _effort_grid[r][c]
 					if c < 5:
-						self.left_usage += l
+						left_usage += l
 					else:
-						self.right_usage += l
-
-		stats = {ch: (r, c, _finger_grid[r][c], _effort_grid[r][c], c<5, 4<=c<=5) for r in range(ROWS) for c in range(COLS) if (ch := self.letters[r][c])}
-
-		max_sum = MAX_E * 2
-		K = max_sum ** 2
-		for pair, count in _bigrams.items():
-			a, b = pair[0], pair[1]
-			if a not in pos or b not in pos:
+						right_usage += l
+
+		score.sfb, score.rolling, score.scissors = \
+			ngram_scores(pos, range(len(BIGRAM_COUNT)), range(len(TRIGRAM_COUNT)))
+		self._score = score
+		self._total = None
+		self._left_usage = left_usage
+		self._right_usage = right_usage
+		self._pos = pos
+
+	@classmethod
+	def from_scores(cls, letters, pos, score, left_usage, right_usage, source=""):
+		layout = object.__new__(cls)
+		layout.letters = letters
+		layout.source = source
+		layout.canonical = None
+		layout._score = score
+		layout._total = None
+		layout._left_usage = left_usage
+		layout._right_usage = right_usage
+		layout._pos = pos
+		return layout
+
+	def swap(self, a, b):
+		r1, c1 = divmod(a, COLS)
+		r2, c2 = divmod(b, COLS)
+		ch1 = self.letters[r1][c1]
+		ch2 = self.letters[r2][c2]
+		if ch1 == ch2:
+			return 0
+		x = LETTER_IDS[ch1] if ch1 else -1
+		y = LETTER_IDS[ch2] if ch2 else -1
+		# score the current letters before they change
+		prev = self.total
+		score = self.score
+		pos = self._pos
+		self.canonical = None
+		global EVALS
+		EVALS += 1
+
+		bigrams, trigrams = affected_ngrams(x, y)
+		sfb1, rolling1, scissors1 = ngram_scores(pos, bigrams, trigrams)
+
+		self.letters[r1][c1], self.letters[r2][c2] = ch2, ch1
+		for i, (r, c), (pr, pc) in ((x, (r2, c2), (r1, c1)), (y, (r1, c1), (r2, c2))):
+			if i < 0:
 				continue
-			r1, _, f1, e1, h1, is_center1 = stats[a]
-			r2, _, f2, e2, h2, is_center2 = stats[b]
-			if h1 != h2: continue
-			row_delta = abs(r1 - r2)
-			is_center = is_center1 or is_center2
-			i = (a in VOWELS) + (b in VOWELS)
-
-			# sfb
-			if f1 == f2:
-				weight = [4.0, 2.0, 1.0][i]
-				weight *= CENTER_WEIGHT if is_center else 1.0
-				weight *= (ROW_WEIGHT ** -row_delta)
-				sfb += count * weight * (e1+e2)
+			pos[i] = (r*COLS) + c
+			l = LETTER_COUNTS[i]
+			score.effort += l * (EFFORT_GRID[r][c] - EFFORT_GRID[pr][pc])
+			if pc < 5:
+				self._left_usage -= l
 			else:
-				has_gap = abs(f1-f2) > 1
-				# scissors
-				if is_center or (not has_gap and row_delta == 2) :
-					scissors += count * (e1+e2)
-				else: # rolling
-					if f1 > f2: # inroll
-						weight = [0.7, 1.0, 0.5][i]
-					elif f1 < f2: # outroll
-						weight = [0.4, 0.6, 0.3][i]
-					weight *= (GAP_WEIGHT ** has_gap)
-					weight *= (ROW_WEIGHT ** row_delta)
-					rolling += count * weight * (K / (e1+e2))
-
-		max_sum = MAX_E * 3
-		min_sum = MIN_E * 3
-		K = max_sum ** 2
-		for pair, count in _trigrams.items():
-			a, b, c = pair[0], pair[1], pair[2]
-			if a not in pos or b not in pos or c not in pos:
+				self._right_usage -= l
+			if c < 5:
+				self._left_usage += l
+			else:
+				self._right_usage += l
+
+		sfb2, rolling2, scissors2 = ngram_scores(pos, bigrams, trigrams)
+		score.sfb += sfb2 - sfb1
+		score.rolling += rolling2 - rolling1
+		score.scissors += scissors2 - scissors1
+
+		self._total = None
+		return self.total - prev
+
+	def move(self, src, dst):
+		# the letters on keys src go to keys dst, a permutation of src; each affected n-gram is scored once
+		# before and once after, or the layout's n-grams once when the move touches most of them
+		letters = self.letters
+		moved = [letters[p // COLS][p % COLS] for p in src]
+		ids = [LETTER_IDS[ch] for ch in moved if ch]
+		prev = self.total
+		score = self.score
+		pos = self._pos
+		undo = (src, dst, score, self._total, self._left_usage, self._right_usage, self.canonical)
+		if not ids:
+			return 0, undo
+		global EVALS
+		EVALS += 1
+
+		bigrams = set(BIGRAM_INDEX[ids[0]])
+		trigrams = set(TRIGRAM_INDEX[ids[0]])
+		for i in ids[1:]:
+			bigrams.update(BIGRAM_INDEX[i])
+			trigrams.update(TRIGRAM_INDEX[i])
+		full = 2 * (len(bigrams) + len(trigrams)) > len(BIGRAM_COUNT) + len(TRIGRAM_COUNT)
+		if full:
+			sfb0 = rolling0 = scissors0 = 0
+			sfb1 = rolling1 = scissors1 = 0
+		else:
+			sfb0, rolling0, scissors0 = score.sfb, score.rolling, score.scissors
+			sfb1, rolling1, scissors1 = ngram_scores(pos, bigrams, trigrams)
+
+		effort = score.effort
+		left_usage = self._left_usage
+		right_usage = self._right_usage
+		for ch, p, q in zip(moved, src, dst):
+			letters[q // COLS][q % COLS] = ch
+			if not ch:
 				continue
-			r1, c1, f1, e1, h1, is_center1 = stats[a]
-			r2, _, f2, e2, h2, is_center2 = stats[b]
-			r3, c3, f3, e3, h3, is_center3 = stats[c]
-			is_center = is_center1 or is_center2 or is_center3
-			row_delta1 = abs(r1 - r2)
-			row_delta2 = abs(r2 - r3)
-			row_delta_sum = row_delta1 + row_delta2
-			has_gap1 = abs(f1 - f2) > 1
-			has_gap2 = abs(f2 - f3) > 1
-			has_gap_sum = has_gap1 + has_gap2
-
-			# sfs
-			if f1 == f3 and f1 != f2:
-				weight = CENTER_WEIGHT if (4<=c1<=5 or 4<=c3<=5) else 1.0
-				weight *= (ROW_WEIGHT ** -abs(r1-r3))
-				weight *= HAND_WEIGHT if h1 != h2 else 1.0
-				sfb += count * weight * (e1+e3)
-
-			# rolling
-			if (h1 == h2 == h3) and f1 != f2 and f2 != f3 and f1 != f3 and \
-					not is_center and row_delta1 != 2 and row_delta2 != 2:
-				i = (a in VOWELS) + (b in VOWELS) + (c in VOWELS)
-				if (f1 > f2 > f3): # inroll
-					weight = [0.6, 1.0, 0.7, 0.3][i]
-				elif (f1 < f2 < f3): # outroll
-					weight = [0.4, 0.6, 0.5, 0.2][i]
-				else: # redirect
-					weight = [-0.6, -1.0, -0.7, -0.3][i]
-
-				if weight > 0:
-					s = 1
-					e = K / (e1+e2+e3)
+			i = LETTER_IDS[ch]
+			pos[i] = q
+			l = LETTER_COUNTS[i]
+			pc, qc = p % COLS, q % COLS
+			effort += l * (EFFORT_GRID[q // COLS][qc] - EFFORT_GRID[p // COLS][pc])
+			if (pc < 5) != (qc < 5):
+				if qc < 5:
+					left_usage += l
+					right_usage -= l
 				else:
-					s = -1
-					e = K / ((max_sum + min_sum) - (e1+e2+e3))
-				weight *= GAP_WEIGHT ** (s * has_gap_sum)
-				weight *= ROW_WEIGHT ** (s * row_delta_sum)
-				rolling += count * weight * e
+					left_usage -= l
+					right_usage += l
 
-		self.score.sfb = sfb
-		self.score.rolling = rolling
-		self.score.scissors = scissors
-
-	def calc_total_score(self):
-		def norm(v, m, d):
-			return (v - m) / d
-
-		r = Score(
-			effort=norm(self.score.effort, SCORE_MEDIAN.effort, SCORE_SCALE.effort),
-			sfb=norm(self.score.sfb, SCORE_MEDIAN.sfb, SCORE_SCALE.sfb),
-			rolling=norm(self.score.rolling, SCORE_MEDIAN.rolling, SCORE_SCALE.rolling),
-			scissors=norm(self.score.scissors, SCORE_MEDIAN.scissors, SCORE_SCALE.scissors),
+		if full:
+			sfb2, rolling2, scissors2 = ngram_scores(pos, range(len(BIGRAM_COUNT)), range(len(TRIGRAM_COUNT)))
+		else:
+			sfb2, rolling2, scissors2 = ngram_scores(pos, bigrams, trigrams)
+		# a new Score, so the one kept for undo stays as it was
+		self._score = Score(
+			effort=effort,
+			sfb=sfb0 + (sfb2 - sfb1),
+			rolling=rolling0 + (rolling2 - rolling1),
+			scissors=scissors0 + (scissors2 - scissors1),
 		)
+		self._left_usage = left_usage
+		self._right_usage = right_usage
+		self._total = None
+		self.canonical = None
+		return self.total - prev, undo
+
+	def restore(self, undo):
+		# reverts a move without rescoring
+		src, dst, score, total, left_usage, right_usage, canonical = undo
+		letters = self.letters
+		pos = self._pos
+		moved = [letters[q // COLS][q % COLS] for q in dst]
+		for ch, p in zip(moved, src):
+			letters[p // COLS][p % COLS] = ch
+			if ch:
+				pos[LETTER_IDS[ch]] = p
+		self._score = score
+		self._total = total
+		self._left_usage = left_usage
+		self._right_usage = right_usage
+		self.canonical = canonical
+
+	def swap_delta(self, a, b):
+		# what swap(a, b) would return, without applying it
+		ch1 = self.letters[a // COLS][a % COLS]
+		ch2 = self.letters[b // COLS][b % COLS]
+		if ch1 == ch2:
+			return 0
+		x = LETTER_IDS[ch1] if ch1 else -1
+		y = LETTER_IDS[ch2] if ch2 else -1
+		global EVALS
+		EVALS += 1
+
+		pos = self.pos
+		bigrams, trigrams = affected_ngrams(x, y)
+		sfb1, rolling1, scissors1 = ngram_scores(pos, bigrams, trigrams)
+		effort = self.score.effort
+		for i, p, q in ((x, a, b), (y, b, a)):
+			if i >= 0:
+				pos[i] = q
+				effort += LETTER_COUNTS[i] * (EFFORT_GRID[q // COLS][q % COLS] - EFFORT_GRID[p // COLS][p % COLS])
+		sfb2, rolling2, scissors2 = ngram_scores(pos, bigrams, trigrams)
+		for i, p in ((x, a), (y, b)):
+			if i >= 0:
+				pos[i] = p
+
+		score = self.score
+		return score_total(Score(
+			effort=effort,
+			sfb=score.sfb + (sfb2 - sfb1),
+			rolling=score.rolling + (rolling2 - rolling1),
+			scissors=score.scissors + (scissors2 - scissors1),
+		)) - self.total
 
-		self.total = int((
-			(-r.effort) * SCORE_RATES.effort +
-			(-r.sfb) * SCORE_RATES.sfb +
-			(r.rolling) * SCORE_RATES.rolling +
-			(-r.scissors) * SCORE_RATES.scissors
-		) * 1e9)
+	def calc_total_score(self):
+		self._total = score_total(self.score)
 
 	def flatten(self):
 		return [item for row in self.letters for item in row]
@@ -197,9 +342,221 @@ class Layout:
 	def flatten_reverse(self):
 		return [item for row in self.letters for item in row[::-1]]
 
-TMP_PATH = None
+class LayoutIndex:
+	"""Kept layouts bucketed by block contents, for "any kept layout within MIN_DISTANCE, mirrored or not" lookups."""
+	__slots__ = ('flats', 'buckets')
+
+	MIN_DISTANCE = 10
+	BLOCK = 3
+
+	def __init__(self):
+		self.flats = []
+		self.buckets = {}
+
+	@classmethod
+	def blocks(cls, flat):
+		# distance < MIN_DISTANCE leaves at least one block untouched when there are MIN_DISTANCE blocks
+		return [(i, flat[i:i+cls.BLOCK]) for i in range(0, len(flat), cls.BLOCK)]
+
+	def near(self, flat):
+		flats = self.flats
+		limit = self.MIN_DISTANCE
+		seen = set()
+		for key in self.blocks(flat):
+			for j in self.buckets.get(key, ()):
+				if j in seen:
+					continue
+				seen.add(j)
+				d = 0
+				for c1, c2 in zip(flat, flats[j]):
+					if c1 != c2:
+						d += 1
+						if d >= limit:
+							break
+				else:
+					return True
+		return False
+
+	def add(self, layout):
+		flat = layout.canonical_key()
+		if self.near(flat) or self.near(mirror_key(flat)):
+			return False
+		j = len(self.flats)
+		self.flats.append(flat)
+		for key in self.blocks(flat):
+			self.buckets.setdefault(key, []).append(j)
+		return True
+
+class P2Quantile:
+	"""Streaming quantile estimate (Jain & Chlamtac's P-square) in constant memory."""
+	__slots__ = ('p', 'heights', 'positions', 'desired', 'increments', 'initial')
+
+	def __init__(self, p):
+		self.p = p
+		self.initial = []
+
+	def add(self, x):
+		if self.initial is not None:
+			self.initial.append(x)
+			if len(self.initial) == 5:
+				p = self.p
+				self.heights = sorted(self.initial)
+				self.positions = [0, 1, 2, 3, 4]
+				self.desired = [0, 2*p, 4*p, 2 + 2*p, 4]
+				self.increments = [0, p/2, p, (1+p)/2, 1]
+				self.initial = None
+			return
+
+		q, n = self.heights, self.positions
+		if x < q[0]:
+			q[0] = x
+			k = 0
+		elif x >= q[4]:
+			q[4] = x
+			k = 3
+		else:
+			k = 0
+			while x >= q[k+1]:
+				k += 1
+		for i in range(k+1, 5):
+			n[i] += 1
+		for i in range(5):
+			self.desired[i] += self.increments[i]
+
+		for i in range(1, 4):
+			d = self.desired[i] - n[i]
+			if (d >= 1 and n[i+1] - n[i] > 1) or (d <= -1 and n[i-1] - n[i] < -1):
+				d = 1 if d > 0 else -1
+				qp = q[i] + d / (n[i+1] - n[i-1]) * (
+					(n[i] - n[i-1] + d) * (q[i+1] - q[i]) / (n[i+1] - n[i]) +
+					(n[i+1] - n[i] - d) * (q[i] - q[i-1]) / (n[i] - n[i-1])
+				)
+				if not q[i-1] < qp < q[i+1]:
+					qp = q[i] + d * (q[i+d] - q[i]) / (n[i+d] - n[i])
+				q[i] = qp
+				n[i] += d
+
+	def value(self):
+		if self.initial is not None:
+			v = sorted(self.initial)
+			m = (len(v) - 1) * self.p
+			lo = int(m)
+			hi = min(lo + 1, len(v) - 1)
+			return v[lo] + (v[hi] - v[lo]) * (m - lo)
+		return self.heights[2]
+
+class NgramCounter:
+	"""Letter, bigram and trigram counts in one flat array indexed by letter code."""
+	__slots__ = ('counts', 'prev1', 'prev2')
+
+	BIGRAM_OFFSET = 26
+	TRIGRAM_OFFSET = 26 + 26**2
+	SIZE = 26 + 26**2 + 26**3
+
+	# byte -> 0..25 for ascii letters (case folded), -1 for everything else
+	CODES = array('b', [-1]) * 256
+	for i in range(26):
+		CODES[ord('a') + i] = CODES[ord('A') + i] = i
+	del i
+
+	def __init__(self, counts=None):
+		self.counts = array('q', [0]) * self.SIZE if counts is None else counts
+		self.prev1 = -1
+		self.prev2 = -1
+
+	@classmethod
+	def from_counters(cls, letters, bigrams, trigrams):
+		counter = cls()
+		counts = counter.counts
+		code = string.ascii_lowercase.index
+		for ch, count in letters.items():
+			counts[code(ch)] = count
+		for bg, count in bigrams.items():
+			counts[cls.BIGRAM_OFFSET + (code(bg[0])*26) + code(bg[1])] = count
+		for tg, count in trigrams.items():
+			counts[cls.TRIGRAM_OFFSET + (((code(tg[0])*26) + code(tg[1])) * 26) + code(tg[2])] = count
+		return counter
+
+	def feed(self, data):
+		# data is a bytes-like chunk; a word may continue into the next feed() call
+		codes = self.CODES
+		counts = self.counts
+		bigram_offset = self.BIGRAM_OFFSET
+		trigram_offset = self.TRIGRAM_OFFSET
+		p1, p2 = self.prev1, self.prev2
+		for b in data:
+			c = codes[b]
+			if c < 0:
+				p1 = p2 = -1
+				continue
+			counts[c] += 1
+			if p1 >= 0:
+				if p1 != c:
+					counts[bigram_offset + (p1*26) + c] += 1
+				if p2 >= 0:
+					counts[trigram_offset + (((p2*26) + p1) * 26) + c] += 1
+			p2 = p1
+			p1 = c
+		self.prev1, self.prev2 = p1, p2
+
+	def end_word(self):
+		self.prev1 = self.prev2 = -1
+
+	def pack(self):
+		# sparse (index, count) arrays; every index fits in 16 bits
+		counts = self.counts
+		indices = array('H', [i for i in range(self.SIZE) if counts[i]])
+		return indices, array('q', [counts[i] for i in indices])
+
+	def add_packed(self, packed):
+		counts = self.counts
+		for i, count in zip(*packed):
+			counts[i] += count
+
+	def to_counters(self):
+		letters = Counter()
+		bigrams = Counter()
+		trigrams = Counter()
+		alphabet = string.ascii_lowercase
+		counts = self.counts
+		for i in range(self.SIZE):
+			count = counts[i]
+			if not count:
+				continue
+			if i < self.BIGRAM_OFFSET:
+				letters[alphabet[i]] = count
+			elif i < self.TRIGRAM_OFFSET:
+				a, b = divmod(i - self.BIGRAM_OFFSET, 26)
+				bigrams[alphabet[a] + alphabet[b]] = count
+			else:
+				ab, c = divmod(i - self.TRIGRAM_OFFSET, 26)
+				a, b = divmod(ab, 26)
+				trigrams[alphabet[a] + alphabet[b] + alphabet[c]] = count
+		return letters, bigrams, trigrams
+
+ANALYZE_PROGRESS = None
+ANALYZE_CHUNK_SIZE = 1000
+DOWNLOAD_WORKERS = 4
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.keeb', 'cache')
+COUNTS_PATH = os.path.join(CACHE_PATH, 'counts')
+BATCH_SIZE = 1024
+READ_CHUNK_SIZE = 1 << 20
 ANALYZE_RESULT_FILENAME = 'analyze_result.tsv'
+ANALYZE_BINARY_FILENAME = 'analyze_result.bin'
+# magic, format version, corpus key, number of count slots; then int64 little-endian counts
+ANALYZE_BINARY_HEADER = struct.Struct('<8sI16sI')
+ANALYZE_BINARY_MAGIC = b'KEEBNGRM'
+ANALYZE_BINARY_VERSION = 1
+ANALYSIS_COUNTS = None
+SCORE_STATE_FILENAME = 'score_state.tsv'
+SCORE_SAMPLE_SIZE = 10000
 RESULT_FILENAME = 'result.txt'
+LINEAGE_DEPTH = 8
+TARGETS_FILENAME = 'targets.txt'
+FAILED_TARGETS_FILENAME = 'failed_targets.txt'
+CHECKPOINT_FILENAME = 'checkpoint.pkl'
+CHECKPOINT_VERSION = 1
+CHECKPOINT_INTERVAL = 60
 
 LETTERS = Counter()
 BIGRAMS = Counter()
@@ -224,14 +581,56 @@ FINGER_GRID = [
 ]
 FINGER_GRID = [r + [v + 4 for v in r[::-1]] for r in FINGER_GRID]
 
+# (row, col, finger, effort, is_left, is_center) by flat position
+KEY_STATS = [
+	(r, c, FINGER_GRID[r][c], EFFORT_GRID[r][c], c<5, 4<=c<=5)
+	for r in range(ROWS) for c in range(COLS)
+]
+
+# Per-count sfb/rolling/scissors weights by position, filled once by init_weight_tables().
+# Bigrams are indexed [vowels][p1][p2], trigram rolling [vowels][p1][p2][p3] and
+# trigram sfb (sfs) [p1][p2][p3], all flattened.
+BIGRAM_SFB = array('d')
+BIGRAM_ROLLING = array('d')
+BIGRAM_SCISSORS = array('d')
+TRIGRAM_SFB = array('d')
+TRIGRAM_ROLLING = array('d')
+
+# Compiled corpus, rebuilt by compile_corpus() whenever LETTERS/BIGRAMS/TRIGRAMS change.
+# Letters are numbered by frequency, ngrams are parallel arrays of letter ids and
+# counts, and *_VOWELS holds the number of vowels in each ngram.
+LETTER_IDS = {}
+LETTER_NAMES = []
+LETTER_COUNTS = array('q')
+BIGRAM_A = array('i')
+BIGRAM_B = array('i')
+BIGRAM_COUNT = array('q')
+BIGRAM_VOWELS = array('b')
+TRIGRAM_A = array('i')
+TRIGRAM_B = array('i')
+TRIGRAM_C = array('i')
+TRIGRAM_COUNT = array('q')
+TRIGRAM_VOWELS = array('b')
+
+# letter id -> indices of every ngram that contains the letter
+BIGRAM_INDEX = []
+TRIGRAM_INDEX = []
+AFFECTED_NGRAMS = {}
+
 SCORE_RATES = Score(
 	sfb = 0.35,
 	scissors = 0.30,
 	rolling = 0.25,
 	effort = 0.10,
 )
-SCORE_MEDIAN = Score()
-SCORE_SCALE = Score()
+SCORE_MEDIAN = None
+SCORE_SCALE = None
+
+# Search budgets, shared with forked workers; EVALS counts full and delta scorings not yet added to EVAL_COUNT
+DEADLINE = None
+EVAL_LIMIT = None
+EVAL_COUNT = None
+EVALS = 0
 
 GAP_WEIGHT = 0.7
 ROW_WEIGHT = 0.8
@@ -319,6 +718,423 @@ EXT_PAREN_STAR_STYLE = {
 	'.pas', '.pp',
 }
 
+EXTENSIONS = EXT_TEXT | EXT_C_STYLE | EXT_SCRIPT_STYLE | EXT_DASH_STYLE | EXT_PERCENT_STYLE | EXT_SEMI_STYLE | EXT_PAREN_STAR_STYLE
+
+# Partial counts are cached per source and per family; bump a family's version
+# when its comment extraction changes and only that family gets recounted.
+FAMILY_EXTENSIONS = {
+	'text': EXT_TEXT,
+	'c': EXT_C_STYLE,
+	'script': EXT_SCRIPT_STYLE,
+	'dash': EXT_DASH_STYLE,
+	'percent': EXT_PERCENT_STYLE,
+	'semi': EXT_SEMI_STYLE,
+	'paren_star': EXT_PAREN_STAR_STYLE,
+}
+EXTRACTOR_VERSIONS = {
+	'text': 1,
+	'c': 3,
+	'script': 2,
+	'dash': 3,
+	'percent': 2,
+	'semi': 2,
+	'paren_star': 2,
+}
+
+# family -> (line comment openers, (block open, block close) pairs, string quotes)
+# Quotes are only skipped so that comment markers inside string literals are
+# ignored; languages where ' is not a string delimiter only list ".
+COMMENT_SYNTAX = {
+	'c': ((b'//',), ((b'/*', b'*/'),), (b'"', b"'")),
+	'script': ((b'#',), (), (b'"', b"'")),
+	'dash': ((b'--',), (), (b'"',)),
+	'percent': ((b'%',), (), (b'"',)),
+	'semi': ((b';',), (), (b'"',)),
+	'paren_star': ((), ((b'(*', b'*)'),), (b'"',)),
+}
+# extra block comments by extension; python docstrings count as comments
+COMMENT_SYNTAX_EXT = {
+	'.py': ((b'"""', b'"""'), (b"'''", b"'''")),
+	'.hs': ((b'{-', b'-}'),),
+	'.lua': ((b'--[[', b']]'),),
+}
+# string quotes by extension where they differ from the family: ' quotes strings in Lua and SQL,
+# but is a lifetime in Rust and a sized literal (8'hFF) in Verilog
+COMMENT_QUOTES_EXT = {
+	'.lua': (b'"', b"'"),
+	'.sql': (b'"', b"'"),
+	'.rs': (b'"',),
+	'.v': (b'"',),
+	'.sv': (b'"',),
+}
+COMMENT_SCANNERS = {}
+
+# GitHub repos, local directories or local .zip archives;
+# a targets.txt next to the analysis result replaces this list
+TARGETS = [
+	'https://github.com/torvalds/linux',            # C
+	'https://github.com/opencv/opencv',             # C++
+	'https://github.com/gcc-mirror/gcc',            # C++
+	'https://github.com/llvm/llvm-project',         # C++/C
+	'https://github.com/python/cpython',            # C/Python
+	'https://github.com/numpy/numpy',               # Python/C
+	'https://github.com/django/django',             # Python
+	'https://github.com/psf/requests',              # Python
+	'https://github.com/facebook/react',            # JavaScript/TypeScript
+	'https://github.com/reactjs/react.dev',
+	'https://github.com/microsoft/vscode',          # TypeScript
+	'https://github.com/sveltejs/svelte',           # JavaScript/TypeScript
+	'https://github.com/nodejs/node',               # JavaScript/C++
+	'https://github.com/denoland/deno',             # TypeScript/Rust
+	'https://github.com/kubernetes/kubernetes',     # Go
+	'https://github.com/golang/go',                 # Go
+	'https://github.com/rust-lang/rust',            # Rust
+	'https://github.com/rust-lang/book',            # Rust
+	'https://github.com/rust-lang/cargo',            # Rust
+	'https://github.com/rust-lang/rfcs',            # Rust
+	'https://github.com/theseus-os/Theseus',        # Rust
+	'https://github.com/bytecodealliance/wasmtime', # Rust
+	'https://github.com/sharkdp/fd',                # Rust
+	'https://github.com/ziglang/zig',               # Zig
+	'https://github.com/vlang/v',                   # V
+	'https://github.com/nim-lang/Nim',              # Nim
+	'https://github.com/carbon-language/carbon-lang', # Carbon
+	'https://github.com/ValeLang/Vale',             # Vale
+	'https://github.com/rails/rails',               # Ruby
+	'https://github.com/elixir-lang/elixir',        # Elixir
+	'https://github.com/apple/swift',               # Swift
+	'https://github.com/JetBrains/kotlin',          # Kotlin
+	'https://github.com/php/php-src',               # PHP
+	'https://github.com/lua/lua',                   # Lua
+	'https://github.com/ghc/ghc',                   # Haskell
+	'https://github.com/scala/scala',               # Scala
+	'https://github.com/wch/r-source',              # R
+	'https://github.com/dotnet/runtime',            # C#
+	'https://github.com/openjdk/jdk',               # Java
+	'https://github.com/ohmyzsh/ohmyzsh',           # Shell
+	'https://github.com/copy/v86',                  # Assembly/JavaScript
+	'https://github.com/cirosantilli/x86-bare-metal-examples', # Assembly/C
+	'https://github.com/mit-pdos/xv6-public',       # C/Assembly
+	'https://github.com/redox-os/redox',            # Rust/Assembly
+	'https://github.com/SerenityOS/serenity',       # C++/Assembly
+	'https://github.com/u-boot/u-boot',             # C/Assembly
+	'https://github.com/coreboot/coreboot',         # C/Assembly
+	'https://github.com/Maratyszcza/PeachPy',       # Python/Assembly
+	'https://github.com/netwide-assembler/nasm',    # Assembly
+	'https://github.com/BeaEngine/BeaEngine',       # Assembly/C
+	'https://github.com/ApolloTeam-dev/AROS',       # C/Assembly
+	'https://github.com/mdn/content',
+	'https://github.com/progit/progit2',
+	'https://github.com/tldr-pages/tldr',
+	'https://github.com/docker/docs',
+	'https://github.com/pytorch/examples',
+	'https://github.com/GITenberg/Moby-Dick--Or-The-Whale_2701',
+	'https://github.com/GITenberg/The-Adventures-of-Sherlock-Holmes_1661',
+	'https://github.com/GITenberg/The-Great-Gatsby_64317',
+	'https://github.com/GITenberg/Alice-s-Adventures-in-Wonderland_11',
+]
+
+def bigram_weights(p1, p2, i):
+	r1, _, f1, e1, h1, is_center1 = KEY_STATS[p1]
+	r2, _, f2, e2, h2, is_center2 = KEY_STATS[p2]
+	sfb = 0
+	rolling = 0
+	scissors = 0
+	if h1 != h2:
+		return sfb, rolling, scissors
+
+	max_sum = MAX_E * 2
+	K = max_sum ** 2
+	row_delta = abs(r1 - r2)
+	is_center = is_center1 or is_center2
+
+	# sfb
+	if f1 == f2:
+		weight = [4.0, 2.0, 1.0][i]
+		weight *= CENTER_WEIGHT if is_center else 1.0
+		weight *= (ROW_WEIGHT ** -row_delta)
+		sfb = weight * (e1+e2)
+	else:
+		has_gap = abs(f1-f2) > 1
+		# scissors
+		if is_center or (not has_gap and row_delta == 2) :
+			scissors = e1+e2
+		else: # rolling
+			if f1 > f2: # inroll
+				weight = [0.7, 1.0, 0.5][i]
+			elif f1 < f2: # outroll
+				weight = [0.4, 0.6, 0.3][i]
+			weight *= (GAP_WEIGHT ** has_gap)
+			weight *= (ROW_WEIGHT ** row_delta)
+			rolling = weight * (K / (e1+e2))
+
+	return sfb, rolling, scissors
+
+def trigram_weights(p1, p2, p3, i):
+	r1, c1, f1, e1, h1, is_center1 = KEY_STATS[p1]
+	r2, _, f2, e2, h2, is_center2 = KEY_STATS[p2]
+	r3, c3, f3, e3, h3, is_center3 = KEY_STATS[p3]
+	sfb = 0
+	rolling = 0
+
+	max_sum = MAX_E * 3
+	min_sum = MIN_E * 3
+	K = max_sum ** 2
+	is_center = is_center1 or is_center2 or is_center3
+	row_delta1 = abs(r1 - r2)
+	row_delta2 = abs(r2 - r3)
+	row_delta_sum = row_delta1 + row_delta2
+	has_gap1 = abs(f1 - f2) > 1
+	has_gap2 = abs(f2 - f3) > 1
+	has_gap_sum = has_gap1 + has_gap2
+
+	# sfs
+	if f1 == f3 and f1 != f2:
+		weight = CENTER_WEIGHT if (4<=c1<=5 or 4<=c3<=5) else 1.0
+		weight *= (ROW_WEIGHT ** -abs(r1-r3))
+		weight *= HAND_WEIGHT if h1 != h2 else 1.0
+		sfb = weight * (e1+e3)
+
+	# rolling
+	if (h1 == h2 == h3) and f1 != f2 and f2 != f3 and f1 != f3 and \
+			not is_center and row_delta1 != 2 and row_delta2 != 2:
+		if (f1 > f2 > f3): # inroll
+			weight = [0.6, 1.0, 0.7, 0.3][i]
+		elif (f1 < f2 < f3): # outroll
+			weight = [0.4, 0.6, 0.5, 0.2][i]
+		else: # redirect
+			weight = [-0.6, -1.0, -0.7, -0.3][i]
+
+		if weight > 0:
+			s = 1
+			e = K / (e1+e2+e3)
+		else:
+			s = -1
+			e = K / ((max_sum + min_sum) - (e1+e2+e3))
+		weight *= GAP_WEIGHT ** (s * has_gap_sum)
+		weight *= ROW_WEIGHT ** (s * row_delta_sum)
+		rolling = weight * e
+
+	return sfb, rolling
+
+def init_weight_tables():
+	global BIGRAM_SFB, BIGRAM_ROLLING, BIGRAM_SCISSORS, TRIGRAM_SFB, TRIGRAM_ROLLING
+	n = ROWS * COLS
+	keys = range(n)
+
+	BIGRAM_SFB = array('d')
+	BIGRAM_ROLLING = array('d')
+	BIGRAM_SCISSORS = array('d')
+	for i in range(3):
+		for p1 in keys:
+			for p2 in keys:
+				sfb, rolling, scissors = bigram_weights(p1, p2, i)
+				BIGRAM_SFB.append(sfb)
+				BIGRAM_ROLLING.append(rolling)
+				BIGRAM_SCISSORS.append(scissors)
+
+	# sfs does not depend on vowels, so only rolling carries the vowel dimension
+	TRIGRAM_SFB = array('d', [0.0]) * (n ** 3)
+	TRIGRAM_ROLLING = array('d', [0.0]) * (4 * n ** 3)
+	for p1 in keys:
+		for p2 in keys:
+			for p3 in keys:
+				k = (((p1*n) + p2) * n) + p3
+				for i in range(4):
+					sfb, rolling = trigram_weights(p1, p2, p3, i)
+					TRIGRAM_ROLLING[(i * n ** 3) + k] = rolling
+				TRIGRAM_SFB[k] = sfb
+
+def ngram_scores(pos, bigrams, trigrams):
+	n = ROWS * COLS
+	sfb = 0
+	rolling = 0
+	scissors = 0
+
+	_a, _b, _count, _vowels = BIGRAM_A, BIGRAM_B, BIGRAM_COUNT, BIGRAM_VOWELS
+	_sfb, _rolling, _scissors = BIGRAM_SFB, BIGRAM_ROLLING, BIGRAM_SCISSORS
+	for i in bigrams:
+		p1 = pos[_a[i]]
+		p2 = pos[_b[i]]
+		if p1 < 0 or p2 < 0:
+			continue
+		k = (((_vowels[i]*n) + p1) * n) + p2
+		count = _count[i]
+		sfb += count * _sfb[k]
+		rolling += count * _rolling[k]
+		scissors += count * _scissors[k]
+
+	_a, _b, _c, _count, _vowels = TRIGRAM_A, TRIGRAM_B, TRIGRAM_C, TRIGRAM_COUNT, TRIGRAM_VOWELS
+	_sfb, _rolling = TRIGRAM_SFB, TRIGRAM_ROLLING
+	n3 = n ** 3
+	for i in trigrams:
+		p1 = pos[_a[i]]
+		p2 = pos[_b[i]]
+		p3 = pos[_c[i]]
+		if p1 < 0 or p2 < 0 or p3 < 0:
+			continue
+		k = (((p1*n) + p2) * n) + p3
+		count = _count[i]
+		sfb += count * _sfb[k]
+		rolling += count * _rolling[(_vowels[i] * n3) + k]
+
+	return sfb, rolling, scissors
+
+def compile_corpus(counts=None):
+	global LETTER_IDS, LETTER_NAMES, LETTER_COUNTS, BIGRAM_INDEX, TRIGRAM_INDEX, AFFECTED_NGRAMS
+	global BIGRAM_A, BIGRAM_B, BIGRAM_COUNT, BIGRAM_VOWELS
+	global TRIGRAM_A, TRIGRAM_B, TRIGRAM_C, TRIGRAM_COUNT, TRIGRAM_VOWELS
+
+	# counts is a dense NgramCounter-layout array, e.g. the mmap of analyze_result.bin
+	if counts is None:
+		counts = NgramCounter.from_counters(LETTERS, BIGRAMS, TRIGRAMS).counts
+
+	alphabet = string.ascii_lowercase
+	codes = sorted((c for c in range(26) if counts[c]), key=lambda c: (-counts[c], c))
+	ids = {c: i for i, c in enumerate(codes)}
+	LETTER_IDS = {alphabet[c]: i for c, i in ids.items()}
+	LETTER_NAMES = [alphabet[c] for c in codes]
+	LETTER_COUNTS = array('q', [counts[c] for c in codes])
+
+	# letter code -> id (-1 when the letter is not in the corpus), and id -> is vowel
+	code_ids = [ids.get(c, -1) for c in range(26)]
+	id_vowels = [alphabet[c] in VOWELS for c in codes]
+
+	def compile_ngrams(offset, n):
+		columns = [array('i') for _ in range(n)]
+		ngram_counts = array('q')
+		vowels = array('b')
+		index = [array('i') for _ in codes]
+		places = [26 ** (n - 1 - j) for j in range(n)]
+		# compress skips the empty slots without a python-level pass over all 26**n of them
+		for k in compress(range(26 ** n), counts[offset:offset + (26 ** n)]):
+			ngram = [code_ids[(k // place) % 26] for place in places]
+			if -1 in ngram:
+				continue
+			for column, i in zip(columns, ngram):
+				column.append(i)
+			for i in set(ngram):
+				index[i].append(len(ngram_counts))
+			ngram_counts.append(counts[offset + k])
+			vowels.append(sum(id_vowels[i] for i in ngram))
+		return columns, ngram_counts, vowels, index
+
+	(BIGRAM_A, BIGRAM_B), BIGRAM_COUNT, BIGRAM_VOWELS, BIGRAM_INDEX = \
+		compile_ngrams(NgramCounter.BIGRAM_OFFSET, 2)
+	(TRIGRAM_A, TRIGRAM_B, TRIGRAM_C), TRIGRAM_COUNT, TRIGRAM_VOWELS, TRIGRAM_INDEX = \
+		compile_ngrams(NgramCounter.TRIGRAM_OFFSET, 3)
+	AFFECTED_NGRAMS = {}
+
+def affected_ngrams(x, y):
+	key = (x, y) if x < y else (y, x)
+	try:
+		return AFFECTED_NGRAMS[key]
+	except KeyError:
+		pass
+
+	result = []
+	for index in (BIGRAM_INDEX, TRIGRAM_INDEX):
+		ngrams = set()
+		for i in key:
+			if i >= 0:
+				ngrams.update(index[i])
+		result.append(array('i', sorted(ngrams)))
+
+	AFFECTED_NGRAMS[key] = result
+	return result
+
+init_weight_tables()
+
+def batch_scores(positions):
+	global EVALS
+	n = ROWS * COLS
+	pos = np.asarray(positions, dtype=np.intp).reshape(-1, len(LETTER_COUNTS))
+	size = len(pos)
+	EVALS += size
+
+	counts = np.frombuffer(LETTER_COUNTS, dtype=np.int64)
+	effort_grid = np.array([e for row in EFFORT_GRID for e in row])
+	is_left = np.array([c < 5 for _ in range(ROWS) for c in range(COLS)])
+	placed = pos >= 0
+	p = np.where(placed, pos, 0)
+	effort = (counts * effort_grid[p] * placed).sum(axis=1)
+	left_usage = (counts * (is_left[p] & placed)).sum(axis=1)
+	right_usage = (counts * (~is_left[p] & placed)).sum(axis=1)
+
+	bigram_ids = (np.frombuffer(BIGRAM_A, dtype=np.int32), np.frombuffer(BIGRAM_B, dtype=np.int32))
+	bigram_count = np.frombuffer(BIGRAM_COUNT, dtype=np.int64)
+	bigram_vowels = np.frombuffer(BIGRAM_VOWELS, dtype=np.int8).astype(np.intp)
+	bigram_tables = [np.frombuffer(t, dtype=np.float64) for t in (BIGRAM_SFB, BIGRAM_ROLLING, BIGRAM_SCISSORS)]
+	trigram_ids = (np.frombuffer(TRIGRAM_A, dtype=np.int32), np.frombuffer(TRIGRAM_B, dtype=np.int32), np.frombuffer(TRIGRAM_C, dtype=np.int32))
+	trigram_count = np.frombuffer(TRIGRAM_COUNT, dtype=np.int64)
+	trigram_vowels = np.frombuffer(TRIGRAM_VOWELS, dtype=np.int8).astype(np.intp)
+	trigram_sfb = np.frombuffer(TRIGRAM_SFB, dtype=np.float64)
+	trigram_rolling = np.frombuffer(TRIGRAM_ROLLING, dtype=np.float64)
+
+	sfb = np.zeros(size)
+	rolling = np.zeros(size)
+	scissors = np.zeros(size)
+	for start in range(0, size, BATCH_SIZE):
+		chunk = pos[start:start+BATCH_SIZE]
+		end = start + len(chunk)
+
+		p1, p2 = chunk[:, bigram_ids[0]], chunk[:, bigram_ids[1]]
+		valid = (p1 >= 0) & (p2 >= 0)
+		k = np.where(valid, (((bigram_vowels*n) + p1) * n) + p2, 0)
+		w = bigram_count * valid
+		for total, table in zip((sfb, rolling, scissors), bigram_tables):
+			total[start:end] += (table[k] * w).sum(axis=1)
+
+		p1, p2, p3 = (chunk[:, ids] for ids in trigram_ids)
+		valid = (p1 >= 0) & (p2 >= 0) & (p3 >= 0)
+		k = np.where(valid, (((p1*n) + p2) * n) + p3, 0)
+		w = trigram_count * valid
+		sfb[start:end] += (trigram_sfb[k] * w).sum(axis=1)
+		rolling[start:end] += (trigram_rolling[(trigram_vowels * n ** 3) + k] * w).sum(axis=1)
+
+	return (
+		effort.tolist(), sfb.tolist(), rolling.tolist(), scissors.tolist(),
+		left_usage.tolist(), right_usage.tolist(),
+	)
+
+def unpack_layout(packed, score, left_usage, right_usage, source):
+	flat = [ch if ch != ' ' else '' for ch in packed.decode()]
+	pos = [-1] * len(LETTER_COUNTS)
+	for i, ch in enumerate(flat):
+		if ch:
+			pos[LETTER_IDS[ch]] = i
+	layout = Layout.from_scores(unflatten(flat), pos, Score(*score), left_usage, right_usage, source)
+	layout.canonical = min(packed, mirror_key(packed))
+	return layout
+
+def lineage_tail(source):
+	# keep the origin and the last LINEAGE_DEPTH steps
+	steps = source.split('->')
+	if len(steps) <= LINEAGE_DEPTH + 1:
+		return source
+	return '->'.join([steps[0], '...'] + steps[-LINEAGE_DEPTH:])
+
+def score_total(score):
+	def norm(v, m, d):
+		return (v - m) / d
+
+	r = Score(
+		effort=norm(score.effort, SCORE_MEDIAN.effort, SCORE_SCALE.effort),
+		sfb=norm(score.sfb, SCORE_MEDIAN.sfb, SCORE_SCALE.sfb),
+		rolling=norm(score.rolling, SCORE_MEDIAN.rolling, SCORE_SCALE.rolling),
+		scissors=norm(score.scissors, SCORE_MEDIAN.scissors, SCORE_SCALE.scissors),
+	)
+
+	return int((
+		(-r.effort) * SCORE_RATES.effort +
+		(-r.sfb) * SCORE_RATES.sfb +
+		(r.rolling) * SCORE_RATES.rolling +
+		(-r.scissors) * SCORE_RATES.scissors
+	) * 1e9)
+
+def mirror_key(flat, cols=COLS):
+	return b''.join(flat[i:i+cols][::-1] for i in range(0, len(flat), cols))
+
 def unflatten(flat, rows=ROWS, cols=COLS):
 	return [flat[i*cols:(i+1)*cols] for i in range(rows)]
 
@@ -340,45 +1156,102 @@ def sort_layouts(layouts: list[Layout]):
 	return layouts
 
 def sort_unique_layouts(layouts: list[Layout], size):
-	layouts = sort_layouts(list(set(layouts)))
+	layouts = sort_layouts(list(dict.fromkeys(layouts)))
 	result = []
+	index = LayoutIndex()
 
 	for layout in layouts:
 		if len(result) == size:
 			break
-		is_unique = True
-		a = layout.flatten()
-		for l in result:
-			if layout == l or \
-					9 >= sum(1 for c1, c2 in zip(a, l.flatten()) if c1 != c2) or \
-					9 >= sum(1 for c1, c2 in zip(a, l.flatten_reverse()) if c1 != c2):
-				is_unique = False
-				break
-
-		if is_unique:
+		if index.add(layout):
 			result.append(layout)
 
 	return result
 
-def init_score_state():
+def score_state_key():
+	h = hashlib.sha256()
+	h.update(repr((ROWS, COLS, SCORE_SAMPLE_SIZE, sorted(LETTERS.items()))).encode())
+	for arr in (
+		BIGRAM_A, BIGRAM_B, BIGRAM_COUNT, BIGRAM_VOWELS,
+		TRIGRAM_A, TRIGRAM_B, TRIGRAM_C, TRIGRAM_COUNT, TRIGRAM_VOWELS,
+		BIGRAM_SFB, BIGRAM_ROLLING, BIGRAM_SCISSORS, TRIGRAM_SFB, TRIGRAM_ROLLING,
+	):
+		h.update(arr.tobytes())
+	h.update(repr((EFFORT_GRID, FINGER_GRID)).encode())
+	return h.hexdigest()
+
+def sample_scores(n):
+	base_layout = make_initial_layout()
+	yield base_layout.score
+	n -= 1
+
+	if np is None:
+		for _ in range(n):
+			yield make_random().score
+		return
+
+	keys = range(ROWS * COLS)
+	while n > 0:
+		size = min(n, BATCH_SIZE)
+		positions = [random.sample(keys, len(LETTER_COUNTS)) for _ in range(size)]
+		effort, sfb, rolling, scissors, _, _ = batch_scores(positions)
+		for values in zip(effort, sfb, rolling, scissors):
+			yield Score(*values)
+		n -= size
+
+def save_score_state(result_path, key):
+	file_path = os.path.join(result_path, SCORE_STATE_FILENAME)
+	with open(file_path, 'w', encoding='utf-8') as f:
+		f.write(f'key\t{key}\n')
+		f.write('\nscore\tmedian\tscale\n')
+		for name in (f.name for f in fields(Score)):
+			f.write(f'{name}\t{getattr(SCORE_MEDIAN, name)!r}\t{getattr(SCORE_SCALE, name)!r}\n')
+
+def load_score_state(result_path, key):
 	global SCORE_MEDIAN, SCORE_SCALE
-	def iqr(v):
-		q = statistics.quantiles(v, n=4, method="inclusive")
-		return q[2] - q[0]
 
-	base_layout = make_initial_layout()
-	unique_layouts = {base_layout.clone()}
-	while len(unique_layouts) < 10000:
-		unique_layouts.add(make_random())
-	layouts = list(unique_layouts)
+	file_path = os.path.join(result_path, SCORE_STATE_FILENAME)
+	if not os.path.exists(file_path):
+		return False
 
-	vals = {f.name: [getattr(l.score, f.name) for l in layouts] for f in fields(Score)}
+	med_map = {}
+	iqr_map = {}
+	with open(file_path, 'r', encoding='utf-8') as f:
+		lines = [line.rstrip('\n').split('\t') for line in f if line.rstrip('\n')]
+	if not lines or lines[0] != ['key', key]:
+		return False
+	for name, med, d in lines[2:]:
+		med_map[name] = float(med)
+		iqr_map[name] = float(d)
+	if set(med_map) != {f.name for f in fields(Score)}:
+		return False
+
+	SCORE_SCALE = Score(**iqr_map)
+	SCORE_MEDIAN = Score(**med_map)
+	return True
+
+def init_score_state(result_path=None):
+	global SCORE_MEDIAN, SCORE_SCALE
+	SCORE_MEDIAN = None
+	SCORE_SCALE = None
+
+	key = score_state_key()
+	if result_path and load_score_state(result_path, key):
+		return
+
+	names = [f.name for f in fields(Score)]
+	quantiles = {k: (P2Quantile(0.25), P2Quantile(0.5), P2Quantile(0.75)) for k in names}
+	for score in sample_scores(SCORE_SAMPLE_SIZE):
+		for k in names:
+			v = getattr(score, k)
+			for q in quantiles[k]:
+				q.add(v)
 
 	med_map = {}
 	iqr_map = {}
-	for k, v in vals.items():
-		d = iqr(v)
-		med = statistics.median(v)
+	for k, (q1, q2, q3) in quantiles.items():
+		d = q3.value() - q1.value()
+		med = q2.value()
 		if d == 0:
 			d = max(abs(med), 1) * 1e-9
 
@@ -388,67 +1261,216 @@ def init_score_state():
 	SCORE_SCALE = Score(**iqr_map)
 	SCORE_MEDIAN = Score(**med_map)
 
-def download_target(url, dest):
-	repo_name = url.rstrip('/').split('/')[-1]
-	base_url = url.rstrip('/') + '/zipball/HEAD'
-	suffix = ''.join(random.choices(string.ascii_lowercase, k=4))
-	target_dir = os.path.join(dest, f"{repo_name}_{suffix}")
-	os.makedirs(target_dir, exist_ok=True)
+	if result_path:
+		save_score_state(result_path, key)
 
-	z = os.path.join(target_dir, f'{repo_name}.zip')
+def resolve_commit(url):
 	try:
-		subprocess.run(
-			[
-				'curl', '-L', '-f', '-s',
-				'--connect-timeout', '30',
-				'--retry', '3',
-				'--retry-delay', '2',
-				'-o', z, base_url
-			],
-			check=True, capture_output=True
-		)
-
-		if zipfile.is_zipfile(z):
-			with zipfile.ZipFile(z, 'r') as zz:
-				zz.extractall(target_dir)
+		out = subprocess.run(
+			['git', 'ls-remote', url, 'HEAD'],
+			check=True, capture_output=True, text=True, timeout=60
+		).stdout
+	except Exception:
+		return None
+	return out.split('\t', 1)[0].strip() or None
+
+def download_target(url):
+	owner, repo_name = url.rstrip('/').split('/')[-2:]
+	prefix = f'{owner}_{repo_name}_'
+	os.makedirs(CACHE_PATH, exist_ok=True)
+	cached = [os.path.join(CACHE_PATH, f) for f in os.listdir(CACHE_PATH) if f.startswith(prefix) and f.endswith('.zip')]
+
+	commit = resolve_commit(url)
+	if commit is None:
+		# no git or no ls-remote access: the newest snapshot we have, else whatever HEAD is now
+		if cached:
+			return max(cached, key=os.path.getmtime)
+		commit = 'HEAD'
+
+	z = os.path.join(CACHE_PATH, f'{prefix}{commit}.zip')
+	if zipfile.is_zipfile(z):
+		return z
+
+	part = z + '.part'
+	if commit == 'HEAD' and os.path.exists(part):
+		# HEAD may have moved since, so its partial download can't be resumed
+		os.remove(part)
+	base_url = url.rstrip('/') + f'/zipball/{commit}'
+	cmd = [
+		'curl', '-L', '-f', '-s',
+		'--connect-timeout', '30',
+		'--retry', '3',
+		'--retry-delay', '2',
+		'-C', '-',
+		'-o', part, base_url
+	]
+	try:
+		try:
+			subprocess.run(cmd, check=True, capture_output=True)
+		except subprocess.CalledProcessError as e:
+			if e.returncode != 33: # server refused to resume, start over
+				raise
+			os.remove(part)
+			subprocess.run(cmd, check=True, capture_output=True)
+
+		if not zipfile.is_zipfile(part):
+			os.remove(part)
+			raise zipfile.BadZipFile(f'{base_url} is not a zip archive')
 	except Exception as e:
+		# a partial download is kept and resumed next time
 		print(e)
-		if os.path.exists(z):
-			os.remove(z)
-		return False
+		return None
+
+	os.replace(part, z)
+	for old in cached:
+		os.remove(old)
+	return z
+
+def fetch_target(target):
+	if '://' in target:
+		path = download_target(target)
+		if path is None:
+			return None
+	else:
+		path = os.path.abspath(os.path.expanduser(target))
 
-	os.remove(z)
-	return True
+	if os.path.isdir(path) or zipfile.is_zipfile(path):
+		return path
+
+	print(f'Unsupported target {target}')
+	return None
+
+def is_target_file(file):
+	name, ext = os.path.splitext(os.path.basename(file))
+	return ext.lower() in EXTENSIONS or name.lower() == 'readme'
+
+def list_target_files(path):
+	if zipfile.is_zipfile(path):
+		with zipfile.ZipFile(path, 'r') as zz:
+			return [info.filename for info in zz.infolist() if not info.is_dir() and is_target_file(info.filename)]
+
+	files = []
+	for root, _, fs in os.walk(path):
+		for file in fs:
+			if is_target_file(file):
+				files.append(os.path.join(root, file))
+	return files
+
+def save_failed_targets(result_path, targets):
+	file_path = os.path.join(result_path, FAILED_TARGETS_FILENAME)
+	if not targets:
+		if os.path.exists(file_path):
+			os.remove(file_path)
+		return
+	with open(file_path, 'w', encoding='utf-8') as f:
+		for target in targets:
+			print(target, file=f)
+
+def load_failed_targets(result_path):
+	file_path = os.path.join(result_path, FAILED_TARGETS_FILENAME)
+	if not os.path.exists(file_path):
+		return []
+	with open(file_path, 'r', encoding='utf-8') as f:
+		return [line.strip() for line in f if line.strip()]
+
+def load_targets(result_path):
+	file_path = os.path.join(result_path, TARGETS_FILENAME)
+	if not os.path.exists(file_path):
+		return TARGETS
+	with open(file_path, 'r', encoding='utf-8') as f:
+		lines = [line.split('#', 1)[0].strip() for line in f]
+	return [line for line in lines if line]
 
 def cleanup(_sig, _frame):
-	global TMP_PATH
-	try:
-		if TMP_PATH and os.path.exists(TMP_PATH):
-			shutil.rmtree(TMP_PATH)
-	except Exception:
-		pass
 	sys.exit(1)
 
-def save_analyze_result(result_path):
+def save_analysis_binary(result_path, key=None):
+	file_path = os.path.join(result_path, ANALYZE_BINARY_FILENAME)
+	if ANALYSIS_COUNTS is not None:
+		counts = array('q', ANALYSIS_COUNTS)
+	else:
+		counts = NgramCounter.from_counters(LETTERS, BIGRAMS, TRIGRAMS).counts
+	if sys.byteorder != 'little':
+		counts.byteswap()
+
+	tmp_path = file_path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(ANALYZE_BINARY_HEADER.pack(
+			ANALYZE_BINARY_MAGIC, ANALYZE_BINARY_VERSION, (key or '').encode(), NgramCounter.SIZE
+		))
+		counts.tofile(f)
+	os.replace(tmp_path, file_path)
+
+def load_analysis_binary(result_path):
+	global LETTERS, BIGRAMS, TRIGRAMS, ANALYSIS_COUNTS
+
+	file_path = os.path.join(result_path, ANALYZE_BINARY_FILENAME)
+	try:
+		with open(file_path, 'rb') as f:
+			mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	except (OSError, ValueError):
+		return False, None
+
+	header = ANALYZE_BINARY_HEADER
+	if len(mm) != header.size + (NgramCounter.SIZE * 8):
+		mm.close()
+		return False, None
+	magic, version, key, size = header.unpack_from(mm)
+	if magic != ANALYZE_BINARY_MAGIC or version != ANALYZE_BINARY_VERSION or size != NgramCounter.SIZE:
+		mm.close()
+		return False, None
+
+	counts = memoryview(mm)[header.size:].cast('q')
+	if sys.byteorder != 'little':
+		counts = array('q', counts)
+		counts.byteswap()
+	# the corpus compiles straight from the map; the bigram and trigram Counters are only
+	# rebuilt from it when a result is saved again
+	ANALYSIS_COUNTS = counts
+	BIGRAMS = TRIGRAMS = None
+	letters = Counter({ch: counts[i] for i, ch in enumerate(string.ascii_lowercase) if counts[i]})
+	LETTERS = Counter(dict(letters.most_common()))
+	compile_corpus(counts)
+	return True, key.rstrip(b'\0').decode() or None
+
+def save_analyze_result(result_path, key=None):
+	save_analysis_binary(result_path, key)
+
+	# human readable export; the binary file is what gets loaded
 	file_path = os.path.join(result_path, ANALYZE_RESULT_FILENAME)
+	if BIGRAMS is None:
+		_, bigrams, trigrams = NgramCounter(ANALYSIS_COUNTS).to_counters()
+	else:
+		bigrams, trigrams = BIGRAMS, TRIGRAMS
 
 	with open(file_path, 'w', encoding='utf-8') as f:
+		if key:
+			f.write(f'corpus\t{key}\n\n')
 		f.write('letter\tfrequency\n')
 		for ch, count in LETTERS.most_common():
 			f.write(f'{ch}\t{count}\n')
 
 		f.write('\nbigram\tfrequency\n')
-		for bg, count in BIGRAMS.most_common():
+		for bg, count in bigrams.most_common():
 			f.write(f'{bg}\t{count}\n')
 
 		f.write('\ntrigram\tfrequency\n')
-		for tg, count in TRIGRAMS.most_common():
+		for tg, count in trigrams.most_common():
 			f.write(f'{tg}\t{count}\n')
 
 def load_analysis_result(result_path):
-	global LETTERS, BIGRAMS, TRIGRAMS
+	global LETTERS, BIGRAMS, TRIGRAMS, ANALYSIS_COUNTS
+
+	loaded, key = load_analysis_binary(result_path)
+	if loaded:
+		return key
+	ANALYSIS_COUNTS = None
 
 	file_path = os.path.join(result_path, ANALYZE_RESULT_FILENAME)
+	LETTERS = Counter()
+	BIGRAMS = Counter()
+	TRIGRAMS = Counter()
+	key = None
 
 	with open(file_path, 'r', encoding='utf-8') as f:
 		section = None
@@ -456,7 +1478,10 @@ def load_analysis_result(result_path):
 			line = line.rstrip('\n')
 			if not line:
 				continue
-			if line.startswith('letter\t'):
+			if line.startswith('corpus\t'):
+				key = line.split('\t')[1]
+				continue
+			elif line.startswith('letter\t'):
 				section = 'letters'
 				continue
 			elif line.startswith('bigram\t'):
@@ -476,133 +1501,72 @@ def load_analysis_result(result_path):
 				tg, count = line.split('\t')
 				TRIGRAMS[tg] = int(count)
 
-def analyze_target_single(full_path):
-	letters = Counter()
-	bigrams = Counter()
-	trigrams = Counter()
-	pattern = re.compile('[a-z]+', re.IGNORECASE)
-	try:
-		with open(full_path, 'r', encoding='utf-8', errors='ignore') as f:
-			text = get_text_content(full_path, f.read())
-			groups = pattern.findall(text)
-			for g in groups:
-				word = g.lower()
-				word = [ch for ch in word if 'a' <= ch <= 'z']
-				for ch in word:
-					letters[ch] += 1
-				for i in range(len(word)-1):
-					if word[i] != word[i+1]:
-						bigrams[word[i] + word[i+1]] += 1
-				for i in range(len(word)-2):
-					trigrams[word[i] + word[i+1] + word[i+2]] += 1
-	except (FileNotFoundError, PermissionError, IsADirectoryError) as e:
-		print(f'Failed: {full_path} — {e}')
-
-	return letters, bigrams, trigrams
-
-def analyze_target(result_path):
-	global LETTERS, BIGRAMS, TRIGRAMS, TMP_PATH
-
-	targets = [
-		'https://github.com/torvalds/linux',            # C
-		'https://github.com/opencv/opencv',             # C++
-		'https://github.com/gcc-mirror/gcc',            # C++
-		'https://github.com/llvm/llvm-project',         # C++/C
-		'https://github.com/python/cpython',            # C/Python
-		'https://github.com/numpy/numpy',               # Python/C
-		'https://github.com/django/django',             # Python
-		'https://github.com/psf/requests',              # Python
-		'https://github.com/facebook/react',            # JavaScript/TypeScript
-		'https://github.com/reactjs/react.dev',
-		'https://github.com/microsoft/vscode',          # TypeScript
-		'https://github.com/sveltejs/svelte',           # JavaScript/TypeScript
-		'https://github.com/nodejs/node',               # JavaScript/C++
-		'https://github.com/denoland/deno',             # TypeScript/Rust
-		'https://github.com/kubernetes/kubernetes',     # Go
-		'https://github.com/golang/go',                 # Go
-		'https://github.com/rust-lang/rust',            # Rust
-		'https://github.com/rust-lang/book',            # Rust
-		'https://github.com/rust-lang/cargo',            # Rust
-		'https://github.com/rust-lang/rfcs',            # Rust
-		'https://github.com/theseus-os/Theseus',        # Rust
-		'https://github.com/bytecodealliance/wasmtime', # Rust
-		'https://github.com/sharkdp/fd',                # Rust
-		'https://github.com/ziglang/zig',               # Zig
-		'https://github.com/vlang/v',                   # V
-		'https://github.com/nim-lang/Nim',              # Nim
-		'https://github.com/carbon-language/carbon-lang', # Carbon
-		'https://github.com/ValeLang/Vale',             # Vale
-		'https://github.com/rails/rails',               # Ruby
-		'https://github.com/elixir-lang/elixir',        # Elixir
-		'https://github.com/apple/swift',               # Swift
-		'https://github.com/JetBrains/kotlin',          # Kotlin
-		'https://github.com/php/php-src',               # PHP
-		'https://github.com/lua/lua',                   # Lua
-		'https://github.com/ghc/ghc',                   # Haskell
-		'https://github.com/scala/scala',               # Scala
-		'https://github.com/wch/r-source',              # R
-		'https://github.com/dotnet/runtime',            # C#
-		'https://github.com/openjdk/jdk',               # Java
-		'https://github.com/ohmyzsh/ohmyzsh',           # Shell
-		'https://github.com/copy/v86',                  # Assembly/JavaScript
-		'https://github.com/cirosantilli/x86-bare-metal-examples', # Assembly/C
-		'https://github.com/mit-pdos/xv6-public',       # C/Assembly
-		'https://github.com/redox-os/redox',            # Rust/Assembly
-		'https://github.com/SerenityOS/serenity',       # C++/Assembly
-		'https://github.com/u-boot/u-boot',             # C/Assembly
-		'https://github.com/coreboot/coreboot',         # C/Assembly
-		'https://github.com/Maratyszcza/PeachPy',       # Python/Assembly
-		'https://github.com/netwide-assembler/nasm',    # Assembly
-		'https://github.com/BeaEngine/BeaEngine',       # Assembly/C
-		'https://github.com/ApolloTeam-dev/AROS',       # C/Assembly
-		'https://github.com/mdn/content',
-		'https://github.com/progit/progit2',
-		'https://github.com/tldr-pages/tldr',
-		'https://github.com/docker/docs',
-		'https://github.com/pytorch/examples',
-		'https://github.com/GITenberg/Moby-Dick--Or-The-Whale_2701',
-		'https://github.com/GITenberg/The-Adventures-of-Sherlock-Holmes_1661',
-		'https://github.com/GITenberg/The-Great-Gatsby_64317',
-		'https://github.com/GITenberg/Alice-s-Adventures-in-Wonderland_11',
-	]
-
-	EXTENSIONS = EXT_TEXT | EXT_C_STYLE | EXT_SCRIPT_STYLE | EXT_DASH_STYLE | EXT_PERCENT_STYLE | EXT_SEMI_STYLE | EXT_PAREN_STAR_STYLE
-
-	# Download
-	len_targets = len(targets)
-	TMP_PATH = tempfile.mkdtemp(dir=os.path.expanduser('~'), prefix='keeb')
-	print('[Download Target]')
-	downloaded = 0
-	for url in targets:
-		if download_target(url, TMP_PATH):
-			downloaded += 1
-			print(f'\r\033[K{downloaded}/{len_targets} ({downloaded/len_targets*100:.1f}%)', end='')
-		else:
-			print(f'Failed {url}')
-	print(f'\r\033[K...Done')
-
-	# file list
-	files = []
-	for root, _, fs in os.walk(TMP_PATH):
-		for file in fs:
-			name, ext = os.path.splitext(file)
-			if ext.lower() in EXTENSIONS or name.lower() == 'readme':
-				files.append(os.path.join(root, file))
-
-	# Calc LETTERS, BIGRAMS
-	print('[Analyze Target]')
-	letters = Counter()
-	bigrams = Counter()
-	trigrams = Counter()
-	len_files = len(files)
-	with ProcessPoolExecutor() as executor:
-		for i, (l, b, t) in enumerate(executor.map(analyze_target_single, files), 1):
-			letters += l
-			bigrams += b
-			trigrams += t
-			print(f'\r\033[K{i}/{len_files} ({i/len_files*100:.1f}%)', end='')
-
+	compile_corpus()
+	save_analysis_binary(result_path, key)
+	return key
+
+def file_family(file):
+	if is_text_file(file):
+		return 'text'
+	_, ext = os.path.splitext(file)
+	for family, extensions in FAMILY_EXTENSIONS.items():
+		if ext.lower() in extensions:
+			return family
+	return None
+
+def family_key(family):
+	return hashlib.sha256(repr((
+		family, EXTRACTOR_VERSIONS[family], sorted(FAMILY_EXTENSIONS[family])
+	)).encode()).hexdigest()[:16]
+
+def corpus_key(targets):
+	return hashlib.sha256(repr((
+		list(targets), [family_key(family) for family in FAMILY_EXTENSIONS]
+	)).encode()).hexdigest()[:16]
+
+def source_key(path, files):
+	# archives by identity, directories by the size/mtime of every analysed file
+	st = os.stat(path)
+	if zipfile.is_zipfile(path):
+		key = (path, st.st_size, st.st_mtime_ns)
+	else:
+		key = [path]
+		for file in files:
+			st = os.stat(file)
+			key.append((os.path.relpath(file, path), st.st_size, st.st_mtime_ns))
+	return hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+
+def save_counts(file_path, packed):
+	indices, counts = packed
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	tmp_path = file_path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(len(indices).to_bytes(4, 'little'))
+		indices.tofile(f)
+		counts.tofile(f)
+	os.replace(tmp_path, file_path)
+
+	# drop partials written for older versions of this family
+	prefix = os.path.basename(file_path).rsplit('_', 1)[0] + '_'
+	for name in os.listdir(os.path.dirname(file_path)):
+		if name.startswith(prefix) and name.endswith('.bin') and name != os.path.basename(file_path):
+			os.remove(os.path.join(os.path.dirname(file_path), name))
+
+def load_counts(file_path):
+	indices = array('H')
+	counts = array('q')
+	with open(file_path, 'rb') as f:
+		n = int.from_bytes(f.read(4), 'little')
+		indices.fromfile(f, n)
+		counts.fromfile(f, n)
+	return indices, counts
+
+def apply_cutoffs(letters, bigrams, trigrams):
+	global LETTERS, BIGRAMS, TRIGRAMS, ANALYSIS_COUNTS
+	ANALYSIS_COUNTS = None
 	LETTERS = letters
+	BIGRAMS = Counter()
+	TRIGRAMS = Counter()
 
 	total_count = sum(bigrams.values())
 	threshold = total_count * 0.99
@@ -622,47 +1586,175 @@ def analyze_target(result_path):
 		if cumulative >= threshold:
 			break
 
-	shutil.rmtree(TMP_PATH)
+	compile_corpus()
+
+def init_analyze_worker(progress):
+	global ANALYZE_PROGRESS
+	ANALYZE_PROGRESS = progress
+
+def analyze_target_single(full_path, counter=None, archive=None):
+	# full_path is a member name when archive (an open ZipFile) is given
+	if counter is None:
+		counter = NgramCounter()
+	counter.end_word()
+	try:
+		with (archive.open(full_path) if archive else open(full_path, 'rb')) as f:
+			if is_text_file(full_path):
+				while chunk := f.read(READ_CHUNK_SIZE):
+					counter.feed(chunk)
+			elif scanner := comment_scanner(full_path):
+				data = f.read()
+				view = memoryview(data)
+				for start, end in comment_spans(data, scanner):
+					counter.feed(view[start:end])
+					counter.end_word()
+	except (FileNotFoundError, PermissionError, IsADirectoryError, KeyError, zipfile.BadZipFile) as e:
+		print(f'Failed: {full_path} — {e}')
+
+	return counter
+
+def analyze_target_chunk(files, archive_path=None):
+	counter = NgramCounter()
+	archive = zipfile.ZipFile(archive_path, 'r') if archive_path else None
+	try:
+		for full_path in files:
+			analyze_target_single(full_path, counter, archive)
+			with ANALYZE_PROGRESS.get_lock():
+				ANALYZE_PROGRESS.value += 1
+	finally:
+		if archive:
+			archive.close()
+	return counter.pack()
+
+def analyze_target(result_path):
+	targets = load_targets(result_path)
+	len_targets = len(targets)
+
+	# Download and analyze: each target is chunked and handed to the
+	# process pool as soon as it is fetched, while other downloads continue
+	print('[Analyze Target]')
+	counter = NgramCounter()
+	progress = multiprocessing.Value('q', 0)
+	fetched = 0
+	failed = set()
+	len_files = 0
+	partials = {} # cache file -> [NgramCounter, chunks left]
+	chunk_files = {}
+	with ProcessPoolExecutor(initializer=init_analyze_worker, initargs=(progress,)) as executor:
+		# fork the analysis workers before any download thread exists
+		executor.submit(int).result()
+		with ThreadPoolExecutor(DOWNLOAD_WORKERS) as downloader:
+			fetching = {downloader.submit(fetch_target, t): t for t in targets}
+			pending = set()
+			while fetching or pending:
+				done, _ = wait(set(fetching) | pending, timeout=0.5, return_when=FIRST_COMPLETED)
+				for future in done:
+					if future in fetching:
+						target = fetching.pop(future)
+						path = future.result()
+						if path is None:
+							print(f'\r\033[KFailed {target}')
+							failed.add(target)
+							continue
+						fetched += 1
+						# zip archives are read in place by the workers, never extracted
+						archive_path = path if zipfile.is_zipfile(path) else None
+						files = list_target_files(path)
+						by_family = {family: [] for family in FAMILY_EXTENSIONS}
+						for file in files:
+							family = file_family(file)
+							if family:
+								by_family[family].append(file)
+
+						source_dir = os.path.join(COUNTS_PATH, source_key(path, files if not archive_path else []))
+						for family, family_files in by_family.items():
+							cache_file = os.path.join(source_dir, f'{family}_{family_key(family)}.bin')
+							if os.path.exists(cache_file):
+								counter.add_packed(load_counts(cache_file))
+								continue
+							if not family_files:
+								save_counts(cache_file, NgramCounter().pack())
+								continue
+
+							len_files += len(family_files)
+							# strided chunks so every chunk gets a mix of small and large files
+							n_chunks = -(-len(family_files) // ANALYZE_CHUNK_SIZE)
+							partials[cache_file] = [NgramCounter(), n_chunks]
+							for i in range(n_chunks):
+								chunk = executor.submit(analyze_target_chunk, family_files[i::n_chunks], archive_path)
+								chunk_files[chunk] = cache_file
+								pending.add(chunk)
+					else:
+						pending.discard(future)
+						cache_file = chunk_files.pop(future)
+						partial = partials[cache_file]
+						partial[0].add_packed(future.result())
+						partial[1] -= 1
+						if partial[1] == 0:
+							packed = partials.pop(cache_file)[0].pack()
+							save_counts(cache_file, packed)
+							counter.add_packed(packed)
+				i = progress.value
+				print(f'\r\033[K{fetched}/{len_targets} targets, {i}/{len_files} files ({i/max(len_files, 1)*100:.1f}%)', end='')
+
+	apply_cutoffs(*counter.to_counters())
 	print(f'\r\033[K...Done')
 
-	# Store result
-	save_analyze_result(result_path)
+	# Store result; targets that failed are recorded and only fetched again on request (--refetch)
+	save_analyze_result(result_path, corpus_key(targets))
+	save_failed_targets(result_path, [t for t in targets if t in failed])
 
-def get_text_content(full_path, original_text):
+def is_text_file(full_path):
 	filename = os.path.basename(full_path)
 	_, ext = os.path.splitext(full_path)
-	ext = ext.lower()
 	is_readme = (filename.lower() == 'readme') or filename.lower().startswith('readme.')
+	return ext.lower() in EXT_TEXT or is_readme
 
-	if ext in EXT_TEXT or is_readme:
-		return original_text
-
-	comments = []
-
-	if ext in EXT_C_STYLE:
-		comments.extend(re.findall(r'/\*[\s\S]*?\*/', original_text))
-		comments.extend(re.findall(r'//.*', original_text))
-	elif ext in EXT_SCRIPT_STYLE:
-		if ext == '.py':
-			comments.extend(re.findall(r'"{3}[\s\S]*?"{3}', original_text))
-			comments.extend(re.findall(r"'{3}[\s\S]*?'{3}", original_text))
-		comments.extend(re.findall(r'#.*', original_text))
-	elif ext in EXT_DASH_STYLE:
-		if ext == '.hs':
-			comments.extend(re.findall(r'\{-[\s\S]*?-\}', original_text))
-		elif ext == '.lua':
-			comments.extend(re.findall(r'--\[\[[\s\S]*?\]\]', original_text))
-		comments.extend(re.findall(r'--.*', original_text))
-	elif ext in EXT_PERCENT_STYLE:
-		comments.extend(re.findall(r'%.*', original_text))
-	elif ext in EXT_SEMI_STYLE:
-		comments.extend(re.findall(r';.*', original_text))
-	elif ext in EXT_PAREN_STAR_STYLE:
-		comments.extend(re.findall(r'\(\*[\s\S]*?\*\)', original_text))
-	else:
-		return ""
+def comment_scanner(full_path):
+	family = file_family(full_path)
+	_, ext = os.path.splitext(full_path)
+	key = (family, ext.lower())
+	try:
+		return COMMENT_SCANNERS[key]
+	except KeyError:
+		pass
 
-	return "\n".join(comments)
+	scanner = None
+	if family in COMMENT_SYNTAX:
+		line_openers, blocks, quotes = COMMENT_SYNTAX[family]
+		blocks = COMMENT_SYNTAX_EXT.get(key[1], ()) + blocks
+		quotes = COMMENT_QUOTES_EXT.get(key[1], quotes)
+		kinds = {}
+		for opener in line_openers:
+			kinds[opener] = ('line', b'\n')
+		for opener, closer in blocks:
+			kinds[opener] = ('block', closer)
+		for quote in quotes:
+			# up to the closing quote, or the end of the line for unterminated/misread quotes
+			kinds[quote] = ('string', re.compile(rb'(?:\\.|[^\\\n' + quote + rb'])*' + quote + rb'?'))
+		tokens = sorted(kinds, key=len, reverse=True)
+		scanner = (re.compile(b'|'.join(re.escape(t) for t in tokens)), kinds)
+
+	COMMENT_SCANNERS[key] = scanner
+	return scanner
+
+def comment_spans(data, scanner):
+	opener, kinds = scanner
+	size = len(data)
+	pos = 0
+	while m := opener.search(data, pos):
+		kind, closer = kinds[m.group()]
+		start = m.end()
+		if kind == 'string':
+			pos = closer.match(data, start).end()
+			continue
+
+		end = data.find(closer, start)
+		if end < 0:
+			yield start, size
+			return
+		yield start, end
+		pos = end + len(closer)
 
 def make_initial_layout() -> Layout:
 	coords = []
@@ -685,37 +1777,157 @@ def make_random() -> Layout:
 	random.shuffle(letters)
 	return Layout(unflatten(letters), source="random")
 
-def crossover(parents: list[Layout], blank=''):
-	parent1 = parents[0].flatten()
-	parent2 = parents[1].flatten()
-	length = len(parent1)
-
-	a, b = sorted(random.sample(range(length), 2))
-	child = [blank] * length
-	for i in range(length):
-		if parent1[i] == blank:
-			child[i] = blank
-	child[a:b] = parent1[a:b]
-
-	for i in range(length):
-		target = parent2[i]
-		if target == blank: continue
-		if target in child: continue
-		for j in range(length):
-			if child[j] is None:
-				child[j] = target
-				break
+def make_randoms(n) -> list[Layout]:
+	result = []
+	for _ in range(n):
+		letters = list(LETTERS.keys())
+		letters.extend([''] * ((COLS*ROWS) - len(letters)))
+		random.shuffle(letters)
+		result.append(unflatten(letters))
+	return make_layouts(result, ["random"] * n)
+
+def make_layouts(letters_list, sources) -> list[Layout]:
+	if np is None or len(letters_list) < 2:
+		return [Layout(l, source=s) for l, s in zip(letters_list, sources)]
+
+	positions = []
+	for letters in letters_list:
+		pos = [-1] * len(LETTER_COUNTS)
+		for p, ch in enumerate(ch for row in letters for ch in row):
+			if ch:
+				pos[LETTER_IDS[ch]] = p
+		positions.append(pos)
+
+	result = []
+	for letters, pos, source, effort, sfb, rolling, scissors, left_usage, right_usage in \
+			zip(letters_list, positions, sources, *batch_scores(positions)):
+		score = Score(effort=effort, sfb=sfb, rolling=rolling, scissors=scissors)
+		result.append(Layout.from_scores([r[:] for r in letters], pos, score, left_usage, right_usage, source))
+	return result
 
-	return Layout(unflatten(child), source=parents[0].source+"->crossover")
+def placed_letters(layout: Layout):
+	return [LETTER_NAMES[i] for i, p in enumerate(layout.pos) if p >= 0]
+
+def layout_permutation(layout: Layout):
+	# slot -> token, the placed letters in id order and then each blank as its own token, so 0..n-1
+	n = ROWS * COLS
+	perm = [-1] * n
+	token = 0
+	for p in layout.pos:
+		if p >= 0:
+			perm[p] = token
+			token += 1
+	for p in range(n):
+		if perm[p] < 0:
+			perm[p] = token
+			token += 1
+	return perm
+
+def permutation_letters(perm, letters):
+	# letters: the placed letters the tokens stand for, as given by placed_letters
+	return unflatten([letters[t] if t < len(letters) else '' for t in perm])
+
+def order_crossover(parent1, parent2):
+	n = len(parent1)
+	a, b = sorted(random.sample(range(n + 1), 2))
+	child = [-1] * n
+	used = [False] * n
+	for i in range(a, b):
+		child[i] = parent1[i]
+		used[parent1[i]] = True
+	# the rest in parent2's order, starting after the copied slice
+	j = b % n
+	for k in range(n):
+		t = parent2[(b + k) % n]
+		if not used[t]:
+			while child[j] >= 0:
+				j = (j + 1) % n
+			child[j] = t
+			used[t] = True
+	return child
+
+def partially_mapped_crossover(parent1, parent2):
+	n = len(parent1)
+	a, b = sorted(random.sample(range(n + 1), 2))
+	child = [-1] * n
+	used = [False] * n
+	index2 = [0] * n
+	for i, t in enumerate(parent2):
+		index2[t] = i
+	for i in range(a, b):
+		child[i] = parent1[i]
+		used[parent1[i]] = True
+	for i in range(a, b):
+		t = parent2[i]
+		if used[t]:
+			continue
+		# follow the mapping until it leaves the slice
+		j = i
+		while a <= j < b:
+			j = index2[parent1[j]]
+		child[j] = t
+		used[t] = True
+	for i in range(n):
+		if child[i] < 0:
+			child[i] = parent2[i]
+	return child
+
+def cycle_crossover(parent1, parent2):
+	n = len(parent1)
+	child = [-1] * n
+	index1 = [0] * n
+	for i, t in enumerate(parent1):
+		index1[t] = i
+	source = parent1
+	for start in range(n):
+		if child[start] >= 0:
+			continue
+		i = start
+		while child[i] < 0:
+			child[i] = source[i]
+			i = index1[parent2[i]]
+		source = parent2 if source is parent1 else parent1
+	return child
+
+CROSSOVERS = (order_crossover, partially_mapped_crossover, cycle_crossover)
+
+def crossover_letters(parents: list[Layout]):
+	letters = placed_letters(parents[0])
+	if letters != placed_letters(parents[1]):
+		# parents placing different letter sets have no common permutation
+		return [row[:] for row in parents[0].letters]
+	parent1 = layout_permutation(parents[0])
+	parent2 = layout_permutation(parents[1])
+	n = len(parent1)
+
+	child = random.choice(CROSSOVERS)(parent1, parent2)
+	seen = [False] * n
+	for t in child:
+		if not 0 <= t < n or seen[t]:
+			raise ValueError(f'invalid crossover child {child}')
+		seen[t] = True
+	return permutation_letters(child, letters)
+
+def crossover(parents: list[Layout]):
+	return Layout(crossover_letters(parents), source=parents[0].source+"->crossover")
+
+def swapped_letters(letters, swaps):
+	l = [row[:] for row in letters]
+	for a, b in swaps:
+		r1, c1 = divmod(a, COLS)
+		r2, c2 = divmod(b, COLS)
+		l[r1][c1], l[r2][c2] = l[r2][c2], l[r1][c1]
+	return l
 
 def fine_tune_effort(base_layout: Layout):
-	letters = [row[:] for row in base_layout.letters]
+	letters = base_layout.letters
 	positions = [(r,c) for r in range(ROWS) for c in range(COLS)]
 	positions.sort(key=lambda pos: LETTERS.get(letters[pos[0]][pos[1]], 0), reverse=True)
-	candidates = [base_layout.clone()]
+	work = base_layout.clone()
+	best_swap = None
+	best_diff = 0
 
 	for (r,c) in positions:
-		l = [row[:] for row in base_layout.letters]
 		best = (r,c)
 		for dr in (-1,0,1):
 			for dc in (-1,0,1):
@@ -723,17 +1935,22 @@ def fine_tune_effort(base_layout: Layout):
 				if 0 <= nr < ROWS and 0 <= nc < COLS:
 					if EFFORT_GRID[nr][nc] < EFFORT_GRID[best[0]][best[1]]:
 						best = (nr , nc)
-		l[r][c], l[best[0]][best[1]] = l[best[0]][best[1]], l[r][c]
-		candidates.append(Layout(l))
+		a, b = (r*COLS) + c, (best[0]*COLS) + best[1]
+		diff = work.swap(a, b)
+		work.swap(a, b)
+		if diff > best_diff:
+			best_diff = diff
+			best_swap = (a, b)
 
-	best = best_layout(candidates)
-	best.source = base_layout.source+"->fine_tune" if best != base_layout else base_layout.source
-	return best
+	if best_swap is None:
+		return base_layout.clone()
+	return Layout(swapped_letters(letters, [best_swap]), source=base_layout.source+"->fine_tune")
 
 def optimize_effort(base_layout: Layout, result_len):
 	orders = ['effort_asc', 'effort_desc', 'count_asc', 'count_desc']
-	letters = [row[:] for row in base_layout.letters]
-	layouts = {base_layout.clone()}
+	work = base_layout.clone()
+	letters = work.letters
+	diffs = {}
 
 	for order in orders:
 		effort_levels = list({val for row in EFFORT_GRID for val in row})
@@ -756,15 +1973,23 @@ def optimize_effort(base_layout: Layout, result_len):
 			for i in range(len(group_coords)):
 				r1, c1 = group_coords[i]
 				for j in range(i+1, len(group_coords)):
+					if budget_exhausted():
+						break
 					r2, c2 = group_coords[j]
 					if letters[r1][c1] == letters[r2][c2]: continue
-					l = [row[:] for row in letters]
-					l[r1][c1], l[r2][c2] = l[r2][c2], l[r1][c1]
-					layouts.add(Layout(l, source=base_layout.source+"->effort"))
+					a, b = sorted(((r1*COLS) + c1, (r2*COLS) + c2))
+					if (a, b) in diffs: continue
+					diffs[(a, b)] = work.swap(a, b)
+					work.swap(a, b)
+
+	# every candidate is a single swap away from base_layout, so only the best few survive sort_unique_layouts
+	layouts = [base_layout.clone()]
+	for swap in sorted(diffs, key=diffs.get, reverse=True)[:result_len]:
+		layouts.append(Layout(swapped_letters(base_layout.letters, [swap]), source=base_layout.source+"->effort"))
 
-	return sort_unique_layouts(list(layouts), result_len)
+	return sort_unique_layouts(layouts, result_len)
 
-def optimize_swap(base_layout: Layout, temperature, max_temp, fix=0):
+def optimize_swap(layout: Layout, temperature, max_temp, fix=0):
 	n = None
 	t = temperature / max_temp
 	if fix == 0:
@@ -777,47 +2002,251 @@ def optimize_swap(base_layout: Layout, temperature, max_temp, fix=0):
 	else:
 		n = fix
 
-	all_coords = [(r, c) for r in range(ROWS) for c in range(COLS)]
-	coords = random.sample(all_coords, n)
-	letters = [row[:] for row in base_layout.letters]
+	coords = random.sample(range(ROWS*COLS), n)
 
 	shuffled = coords[:]
 	random.shuffle(shuffled)
 
-	for i in range(n):
-		r1, c1 = coords[i]
-		r2, c2 = shuffled[i]
-		letters[r1][c1], letters[r2][c2] = letters[r2][c2], letters[r1][c1]
-
-	return Layout(letters, source=base_layout.source)
+	# applied in place; undo with layout.restore
+	return layout.move(coords, shuffled)
 
 def optimize_shuffle(base_layout: Layout, result_len, length=6, custom=""):
 	base_letters = base_layout.letters
 
 	if custom:
+		# blanks are not letters; '' in custom would otherwise pull every blank key in
 		target_positions = [
 			(r, c) for r in range(ROWS) for c in range(COLS)
-			if base_letters[r][c] in custom
+			if base_letters[r][c] and base_letters[r][c] in custom
 		]
 	else:
 		all_positions = [(r, c) for r in range(ROWS) for c in range(COLS)]
 		target_positions = random.sample(all_positions, length)
 
-	letters = [base_letters[r][c] for r, c in target_positions]
-	layouts = [base_layout.clone()]
-	perms = permutations(target_positions, len(target_positions))
+	positions = [(r*COLS) + c for r, c in target_positions]
 
-	l = [r[:] for r in base_layout.letters]
-	for perm in perms:
-		for i, (r, c) in enumerate(perm):
-			l[r][c] = letters[i]
+	layouts = [base_layout.clone()]
+	for arrangement in best_arrangements(base_layout, positions, result_len):
+		l = [r[:] for r in base_letters]
+		for p, ch in zip(positions, arrangement):
+			l[p // COLS][p % COLS] = ch
 		layouts.append(Layout(l, source=base_layout.source+"->shuffle"))
 
 	if custom:
-		return sort_layouts(list(set(layouts)))[:result_len]
+		return sort_layouts(list(dict.fromkeys(layouts)))[:result_len]
 	else:
 		return sort_unique_layouts(layouts, result_len)
 
+def assignment_bound(rows, cols):
+	# Hungarian method: the best total of rows[i][col] with every row on a distinct col
+	n, m = len(rows), len(cols)
+	inf = float('inf')
+	u = [0.0] * (n + 1)
+	v = [0.0] * (m + 1)
+	match = [0] * (m + 1)
+	way = [0] * (m + 1)
+	for i in range(1, n + 1):
+		match[0] = i
+		j0 = 0
+		minv = [inf] * (m + 1)
+		used = [False] * (m + 1)
+		while True:
+			used[j0] = True
+			i0 = match[j0]
+			row = rows[i0 - 1]
+			ui = u[i0]
+			delta = inf
+			j1 = 0
+			for j in range(1, m + 1):
+				if not used[j]:
+					cur = -row[cols[j - 1]] - ui - v[j]
+					if cur < minv[j]:
+						minv[j] = cur
+						way[j] = j0
+					if minv[j] < delta:
+						delta = minv[j]
+						j1 = j
+			for j in range(m + 1):
+				if used[j]:
+					u[match[j]] += delta
+					v[j] -= delta
+				else:
+					minv[j] -= delta
+			j0 = j1
+			if match[j0] == 0:
+				break
+		while j0:
+			j1 = way[j0]
+			match[j0] = match[j1]
+			j0 = j1
+	return v[0]
+
+def best_arrangements(layout: Layout, positions, result_len):
+	# Exact top result_len arrangements of the letters on positions, by branch and bound.
+	# total is linear in the raw scores, so only n-grams touching a moved letter matter. They are
+	# summed per group of moved letters into tables over the target keys; a group is scored exactly
+	# once one letter is left, and until then bounded by its best placement given the letters already placed.
+	n = ROWS * COLS
+	n3 = n ** 3
+	ce = -1e9 * SCORE_RATES.effort / SCORE_SCALE.effort
+	cs = -1e9 * SCORE_RATES.sfb / SCORE_SCALE.sfb
+	cr = 1e9 * SCORE_RATES.rolling / SCORE_SCALE.rolling
+	cx = -1e9 * SCORE_RATES.scissors / SCORE_SCALE.scissors
+	effort = [e for row in EFFORT_GRID for e in row]
+
+	def bigram_weight(v, p1, p2):
+		k = (((v*n) + p1) * n) + p2
+		return (cs * BIGRAM_SFB[k]) + (cr * BIGRAM_ROLLING[k]) + (cx * BIGRAM_SCISSORS[k])
+
+	def trigram_weight(v, p1, p2, p3):
+		k = (((p1*n) + p2) * n) + p3
+		return (cs * TRIGRAM_SFB[k]) + (cr * TRIGRAM_ROLLING[(v * n3) + k])
+
+	pos = layout.pos[:]
+	# ids are ordered by frequency, so frequent letters are placed first
+	free = sorted(i for i, p in enumerate(pos) if p in positions)
+	for i in free:
+		pos[i] = -1
+	is_free = set(free)
+	k = len(positions)
+	slots = range(k)
+
+	# gains[x][j]: exactly what placing x on positions[j] adds, given everything placed so far
+	gains = {x: [ce * LETTER_COUNTS[x] * effort[p] for p in positions] for x in free}
+	pairs = {}    # (x, y): [jx][jy]
+	triples = {}  # (x, y, z): {(jx, jy): [jz]}
+	for ngrams, columns, counts, vowels, weight in (
+		(BIGRAM_INDEX, (BIGRAM_A, BIGRAM_B), BIGRAM_COUNT, BIGRAM_VOWELS, bigram_weight),
+		(TRIGRAM_INDEX, (TRIGRAM_A, TRIGRAM_B, TRIGRAM_C), TRIGRAM_COUNT, TRIGRAM_VOWELS, trigram_weight),
+	):
+		for i in sorted({i for x in free for i in ngrams[x]}):
+			letters = [column[i] for column in columns]
+			if any(pos[x] < 0 and x not in is_free for x in letters):
+				continue
+			moving = sorted(set(x for x in letters if x in is_free))
+			v, c = vowels[i], counts[i]
+			x = moving[0]
+			if len(moving) == 1:
+				row = gains[x]
+				for j in slots:
+					pos[x] = positions[j]
+					row[j] += c * weight(v, *(pos[w] for w in letters))
+			elif len(moving) == 2:
+				y = moving[1]
+				table = pairs.setdefault((x, y), [[0.0] * k for _ in slots])
+				for jx in slots:
+					pos[x] = positions[jx]
+					row = table[jx]
+					for jy in slots:
+						if jy != jx:
+							pos[y] = positions[jy]
+							row[jy] += c * weight(v, *(pos[w] for w in letters))
+			else:
+				y, z = moving[1], moving[2]
+				table = triples.setdefault((x, y, z), {})
+				for jx in slots:
+					pos[x] = positions[jx]
+					for jy in slots:
+						if jy == jx:
+							continue
+						pos[y] = positions[jy]
+						row = table.setdefault((jx, jy), [0.0] * k)
+						for jz in slots:
+							if jz != jx and jz != jy:
+								pos[z] = positions[jz]
+								row[jz] += c * weight(v, *(pos[w] for w in letters))
+			for w in moving:
+				pos[w] = -1
+
+	# upper[x][j]: gains plus, for every group x is the first unplaced letter of, its best value with x on
+	# positions[j] and the other letters anywhere; letters are placed in order, so that is known up front
+	upper = {x: gains[x][:] for x in free}
+	later_pairs = {x: [] for x in free}
+	first_of = {x: [] for x in free}
+	second_of = {x: [] for x in free}
+	for (x, y), table in pairs.items():
+		best_x = [max((table[jx][jy] for jy in slots if jy != jx), default=0) for jx in slots]
+		upper[x] = list(map(add, upper[x], best_x))
+		later_pairs[x].append((y, table))
+	for key, table in triples.items():
+		x, y, z = key
+		# best over z for each (jx, jy), then over y for each jx
+		by_pair = [[float('-inf')] * k for _ in slots]
+		for (jx, jy), row in table.items():
+			by_pair[jx][jy] = max((row[jz] for jz in slots if jz != jx and jz != jy), default=0)
+		upper[x] = list(map(add, upper[x], [max(row) for row in by_pair]))
+		first_of[x].append((y, by_pair))
+		second_of[y].append((key, z, table))
+
+	taken = [False] * k
+	at = {}
+	best = []
+	count = 0
+
+	def place(x, j):
+		pos[x] = positions[j]
+		at[x] = j
+		taken[j] = True
+		saved = []
+		for y, table in later_pairs[x]:
+			row = table[j]
+			saved.append((y, gains[y], upper[y]))
+			gains[y] = list(map(add, gains[y], row))
+			upper[y] = list(map(add, upper[y], row))
+		for y, by_pair in first_of[x]:
+			saved.append((y, gains[y], upper[y]))
+			upper[y] = list(map(add, upper[y], by_pair[j]))
+		for key, z, table in second_of[x]:
+			row = table[(at[key[0]], j)]
+			saved.append((z, gains[z], upper[z]))
+			gains[z] = list(map(add, gains[z], row))
+			upper[z] = list(map(add, upper[z], row))
+		return saved
+
+	def unplace(x, j, saved):
+		pos[x] = -1
+		del at[x]
+		taken[j] = False
+		for y, gain_row, upper_row in reversed(saved):
+			gains[y] = gain_row
+			upper[y] = upper_row
+
+	def search(depth, score):
+		nonlocal count
+		if depth == len(free):
+			item = (score, count, [pos[x] for x in free])
+			count += 1
+			if len(best) < result_len:
+				heapq.heappush(best, item)
+			elif item > best[0]:
+				heapq.heapreplace(best, item)
+			return
+
+		open_slots = [j for j in slots if not taken[j]]
+		if len(best) >= result_len:
+			# each letter on its best open key first, then the exact assignment of letters to open keys
+			rows = [upper[y] for y in free[depth:]]
+			floor = best[0][0] - score
+			if sum(max(row[j] for j in open_slots) for row in rows) <= floor or \
+					assignment_bound(rows, open_slots) <= floor:
+				return
+
+		x = free[depth]
+		row = upper[x]
+		gain_row = gains[x]
+		for j in sorted(open_slots, key=lambda j: -row[j]):
+			saved = place(x, j)
+			search(depth + 1, score + gain_row[j])
+			unplace(x, j, saved)
+
+	search(0, 0)
+
+	arrangements = []
+	for _, _, placed in sorted(best, reverse=True):
+		letter_at = dict(zip(placed, free))
+		arrangements.append([LETTER_NAMES[letter_at[p]] if p in letter_at else '' for p in positions])
+	return arrangements
+
 def optimize_sa(base_layout: Layout, result_len, max_iter=10000, cooling_rate=0.9985):
 	best = base_layout.clone()
 	cur = base_layout.clone()
@@ -827,8 +2256,9 @@ def optimize_sa(base_layout: Layout, result_len, max_iter=10000, cooling_rate=0.
 	result = [best.clone()]
 
 	for i in range(max_iter):
-		new_layout = optimize_swap(cur, temperature, initial_temp)
-		diff = new_layout.total - cur.total
+		if budget_exhausted():
+			break
+		diff, undo = optimize_swap(cur, temperature, initial_temp)
 
 		if diff >= 0:
 			accept = True
@@ -838,12 +2268,13 @@ def optimize_sa(base_layout: Layout, result_len, max_iter=10000, cooling_rate=0.
 			accept = prob > random.random()
 
 		if accept:
-			cur = new_layout
 			if cur.total > best.total:
 				best = cur.clone()
 				best.source += f"->sa_{i}"
 				result.append(best.clone())
 				temperature *= 1.05
+		else:
+			cur.restore(undo)
 		temperature *= cooling_rate
 
 		if temperature < stop_temp:
@@ -851,70 +2282,620 @@ def optimize_sa(base_layout: Layout, result_len, max_iter=10000, cooling_rate=0.
 
 	return sort_unique_layouts(result, result_len)
 
-def optimize(base_layouts: list[Layout], result_path, elites_len=5):
+def checkpoint_path(result_path, mode):
+	return os.path.join(result_path, f'{mode}_{CHECKPOINT_FILENAME}')
+
+def save_checkpoint(result_path, mode, state):
+	file_path = checkpoint_path(result_path, mode)
+	# layouts unpickle against the compiled corpus and score state, so those are checked before the state is loaded
+	checkpoint = {
+		'version': CHECKPOINT_VERSION,
+		'mode': mode,
+		'key': score_state_key(),
+		'score': (astuple(SCORE_MEDIAN), astuple(SCORE_SCALE)),
+		'state': pickle.dumps(state, pickle.HIGHEST_PROTOCOL),
+	}
+	tmp_path = file_path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		pickle.dump(checkpoint, f, pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_path, file_path)
+
+def load_checkpoint(result_path, mode):
+	global SCORE_MEDIAN, SCORE_SCALE
+
+	file_path = checkpoint_path(result_path, mode)
+	try:
+		with open(file_path, 'rb') as f:
+			checkpoint = pickle.load(f)
+	except FileNotFoundError:
+		return None
+	except (OSError, EOFError, pickle.UnpicklingError) as e:
+		print(f'Ignoring unreadable checkpoint: {e}')
+		return None
+
+	if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('mode') != mode:
+		print(f'Ignoring checkpoint from another version')
+		return None
+	if checkpoint.get('key') != score_state_key():
+		print(f'Ignoring checkpoint from another corpus')
+		return None
+
+	median, scale = checkpoint['score']
+	SCORE_MEDIAN = Score(*median)
+	SCORE_SCALE = Score(*scale)
+	return pickle.loads(checkpoint['state'])
+
+def remove_checkpoint(result_path, mode):
+	try:
+		os.remove(checkpoint_path(result_path, mode))
+	except FileNotFoundError:
+		pass
+
+def init_budget(seconds=None, evals=None):
+	global DEADLINE, EVAL_LIMIT, EVAL_COUNT, EVALS
+	DEADLINE = time.monotonic() + seconds if seconds is not None else None
+	EVAL_LIMIT = evals
+	EVAL_COUNT = multiprocessing.Value('q', 0)
+	EVALS = 0
+
+def flush_evaluations():
+	global EVALS
+	if EVAL_COUNT is not None and EVALS:
+		with EVAL_COUNT.get_lock():
+			EVAL_COUNT.value += EVALS
+	EVALS = 0
+
+def reset_evaluations():
+	# forked workers start with a copy of the parent's unflushed count
+	global EVALS
+	EVALS = 0
+
+def budget_exhausted():
+	if DEADLINE is not None and time.monotonic() >= DEADLINE:
+		return True
+	return EVAL_LIMIT is not None and EVAL_COUNT.value + EVALS >= EVAL_LIMIT
+
+def init_population(base_layouts, max_population):
+	# dicts rather than sets keep the order, and so a seeded or resumed run, reproducible
+	unique_population = dict.fromkeys(l.clone() for l in base_layouts)
+	while len(unique_population) < max_population:
+		unique_population.update(dict.fromkeys(make_randoms(max_population - len(unique_population))))
+	return sort_layouts(list(unique_population))
+
+def evolve(population, elites, target, progress, max_population, elites_len, run_workers):
+	random_len = int(max_population* max(0.05, 0.3 * (1 - progress)))
+
+	parents_pool = population + elites
+	parents = [best_layout(random.sample(parents_pool, 3)) for _ in range(max_population)]
+	pairs = [random.sample(parents, 2) for _ in range(max_population - target - random_len)]
+	children = make_layouts(
+		[crossover_letters(p) for p in pairs],
+		[p[0].source+"->crossover" for p in pairs],
+	)
+
+	# Make next
+	population = []
+	for r in run_workers(children + elites[:target], progress, elites_len):
+		population.extend(r)
+	population = sort_unique_layouts(population, max_population-random_len)
+	population.extend(make_randoms(max_population - len(population)))
+	population = sort_layouts(population)
+
+	# Elites; past the deadline the population is taken as is
+	if budget_exhausted():
+		elites = elites + population
+	else:
+		elites = elites + [fine_tune_effort(l) for l in population]
+	return population, sort_unique_layouts(elites, elites_len)
+
+def optimize_tabu(base_layout: Layout, result_len, max_iter=200, tenure=None, aspiration=None):
+	# Robust tabu search (Taillard): best non-tabu swap of the full neighbourhood each step, with
+	# randomised tenure, aspiration on a new best, and a forced move for placements untried too long.
+	n = ROWS * COLS
+	tenure_min, tenure_max = tenure or (int(0.9 * n), int(1.1 * n))
+	aspiration = aspiration or (n * n * 2)
+	moves = [(a, b) for a in range(n) for b in range(a + 1, n)]
+	moves_at = [[m for m, (a, b) in enumerate(moves) if p in (a, b)] for p in range(n)]
+	cs = -1e9 * SCORE_RATES.sfb / SCORE_SCALE.sfb
+	cr = 1e9 * SCORE_RATES.rolling / SCORE_SCALE.rolling
+	cx = -1e9 * SCORE_RATES.scissors / SCORE_SCALE.scissors
+
+	shared = {}
+	def shared_ngrams(i, j):
+		# n-grams holding both letters i and j
+		key = (i, j) if i < j else (j, i)
+		try:
+			return shared[key]
+		except KeyError:
+			pass
+		result = shared[key] = (
+			sorted(set(BIGRAM_INDEX[i]).intersection(BIGRAM_INDEX[j])),
+			sorted(set(TRIGRAM_INDEX[i]).intersection(TRIGRAM_INDEX[j])),
+		)
+		return result
+
+	def partial_delta(pos, u, v, s, t, bigrams, trigrams):
+		# the change of total from swapping keys u and v (letters s and t), over the given n-grams only
+		sfb0, rolling0, scissors0 = ngram_scores(pos, bigrams, trigrams)
+		if s >= 0:
+			pos[s] = v
+		if t >= 0:
+			pos[t] = u
+		sfb1, rolling1, scissors1 = ngram_scores(pos, bigrams, trigrams)
+		if s >= 0:
+			pos[s] = u
+		if t >= 0:
+			pos[t] = v
+		return (cs * (sfb1 - sfb0)) + (cr * (rolling1 - rolling0)) + (cx * (scissors1 - scissors0))
+
+	cur = base_layout.clone()
+	best = cur.clone()
+	result = [best.clone()]
+	at = [-1] * n
+	for i, p in enumerate(cur.pos):
+		if p >= 0:
+			at[p] = i
+	# tabu[x][p]: the step until which letter x may not move back onto key p
+	tabu = [[-((n * x) + p) for p in range(n)] for x in range(len(LETTER_COUNTS))]
+	deltas = [cur.swap_delta(a, b) for a, b in moves]
+	pos = cur.pos
+
+	for step in range(1, max_iter + 1):
+		if budget_exhausted():
+			break
+
+		chosen = None
+		chosen_delta = None
+		for m, (a, b) in enumerate(moves):
+			x, y = at[a], at[b]
+			if x < 0 and y < 0:
+				continue
+			delta = deltas[m]
+			# a blank carries no tabu state, so a single letter move is judged on that letter alone
+			tabu_x = tabu[x][b] if x >= 0 else tabu[y][a]
+			tabu_y = tabu[y][a] if y >= 0 else tabu_x
+			if tabu_x < step - aspiration and tabu_y < step - aspiration:
+				chosen = m
+				break
+			allowed = tabu_x < step or tabu_y < step
+			if (allowed or cur.total + delta > best.total) and (chosen_delta is None or delta > chosen_delta):
+				chosen = m
+				chosen_delta = delta
+		if chosen is None:
+			break
+
+		a, b = moves[chosen]
+		x, y = at[a], at[b]
+		# swaps away from keys a and b change only through the n-grams they share with letters x and y:
+		# those are taken out at the current placement and added back once a and b are swapped
+		touched = set(moves_at[a]).union(moves_at[b])
+		partial = []
+		for m, (u, v) in enumerate(moves):
+			s, t = at[u], at[v]
+			if m in touched or (s < 0 and t < 0):
+				continue
+			bigrams = set()
+			trigrams = set()
+			for i in (s, t):
+				if i < 0:
+					continue
+				for j in (x, y):
+					if j >= 0:
+						bg, tg = shared_ngrams(i, j)
+						bigrams.update(bg)
+						trigrams.update(tg)
+			if bigrams or trigrams:
+				partial.append((m, u, v, s, t, bigrams, trigrams, partial_delta(pos, u, v, s, t, bigrams, trigrams)))
+
+		cur.swap(a, b)
+		at[a], at[b] = y, x
+		if x >= 0:
+			tabu[x][a] = step + random.randint(tenure_min, tenure_max)
+		if y >= 0:
+			tabu[y][b] = step + random.randint(tenure_min, tenure_max)
+		if cur.total > best.total:
+			best = cur.clone()
+			best.source += f"->tabu_{step}"
+			result.append(best.clone())
+
+		for m, u, v, s, t, bigrams, trigrams, prev in partial:
+			deltas[m] += partial_delta(pos, u, v, s, t, bigrams, trigrams) - prev
+		for m in touched:
+			deltas[m] = cur.swap_delta(*moves[m])
+
+	return sort_unique_layouts(result, result_len)
+
+def optimize(base_layouts: list[Layout], result_path, elites_len=5, plateau=None, checkpoint=None):
 	gen_by_target = 20
 	max_generation = elites_len*gen_by_target
 	max_population = elites_len*gen_by_target
-	elites = [l.clone() for l in base_layouts[:elites_len]]
 
-	# Init population
-	unique_population = {l.clone() for l in base_layouts}
-	while len(unique_population) < max_population:
-		unique_population.add(make_random())
-	population = sort_layouts(list(unique_population))
+	if checkpoint is None:
+		elites = [l.clone() for l in base_layouts[:elites_len]]
 
-	with ProcessPoolExecutor() as executor:
+		# Init population
+		population = init_population(base_layouts, max_population)
 		prev = elites[0].total
 		gen = 1
-		while gen <= max_generation:
+		stale = 0
+	else:
+		population, elites = checkpoint['population'], checkpoint['elites']
+		prev, gen, stale = checkpoint['prev'], checkpoint['gen'], checkpoint['stale']
+		random.setstate(checkpoint['rng'])
+		print(f'[Resume] generation {gen}/{max_generation}')
+
+	def state():
+		return {
+			'population': population, 'elites': elites,
+			'prev': prev, 'gen': gen, 'stale': stale,
+			'rng': random.getstate(),
+		}
+
+	with ProcessPoolExecutor(initializer=reset_evaluations) as executor:
+		def run_workers(tasks, progress, result_len):
+			# per-task seeds drawn from the parent keep a resumed run on the same path
+			return executor.map(
+				optimize_worker,
+				tasks,
+				[progress] * len(tasks),
+				[result_len] * len(tasks),
+				[random.getrandbits(64) for _ in tasks],
+				chunksize=max(1, len(tasks) // ((os.cpu_count() or 1) * 4)),
+			)
+
+		saved = time.monotonic()
+		while gen <= max_generation and (plateau is None or stale < plateau) and not budget_exhausted():
 			target = gen // gen_by_target + 1
 			print(f'\r\033[K...{gen}/{max_generation}', end='')
-			random_len = int(max_population* max(0.05, 0.3 * (1 - gen/ max_generation)))
 
-			parents_pool = population + elites
-			parents = [best_layout(random.sample(parents_pool, 3)) for _ in range(max_population)]
-			children = [crossover(random.sample(parents, 2)) for _ in range(max_population - target - random_len)]
-
-			# Make next
-			population = []
 			progress = min(gen/max_generation, 1.0)
-			result = list(executor.map(
-				optimize_worker,
-				children + elites[:target],
-				[progress] * (len(children)+target),
-				[elites_len] * (len(children)+target)
-			))
-			for r in result:
-				population.extend(r)
-			population = sort_unique_layouts(population, max_population-random_len)
-			while len(population) < max_population:
-				population.append(make_random())
-			population = sort_layouts(population)
-
-			# Elites
-			elites.extend([fine_tune_effort(l) for l in population])
-			elites = sort_unique_layouts(elites, elites_len)
+			population, elites = evolve(population, elites, target, progress, max_population, elites_len, run_workers)
+			flush_evaluations()
 			target_total = elites[target-1].total if len(elites) >= target else elites[-1].total
 			if prev != target_total:
 				print(f'\t improved ({prev:,} -> {target_total:,})')
 				prev = target_total
 				save_result(elites, result_path)
+				stale = 0
 			else:
 				gen += 1
+				stale += 1
+
+			if time.monotonic() - saved >= CHECKPOINT_INTERVAL:
+				save_checkpoint(result_path, 'ga', state())
+				saved = time.monotonic()
+
+	save_result(elites, result_path)
+	if budget_exhausted():
+		save_checkpoint(result_path, 'ga', state())
+	else:
+		remove_checkpoint(result_path, 'ga')
+	return elites
+
+def optimize_islands(base_layouts: list[Layout], result_path, elites_len=5, islands=None, plateau=None,
+		checkpoint=None):
+	if checkpoint is None:
+		islands = islands or os.cpu_count() or 1
+		island_states = [None] * islands
+		elites = [l.clone() for l in base_layouts[:elites_len]]
+	else:
+		# migrants in flight at the time of the checkpoint are lost
+		island_states, elites = checkpoint['islands'], checkpoint['elites']
+		islands = len(island_states)
+		random.setstate(checkpoint['rng'])
+		print(f'[Resume] {islands} islands')
+	gen_by_target = 20
+	max_generation = elites_len*gen_by_target
+	# the GA population split across islands, but never so small that selection degenerates
+	max_population = max(elites_len*4, (elites_len*gen_by_target) // islands)
+
+	def state():
+		return {'islands': island_states, 'elites': elites, 'rng': random.getstate()}
+
+	report = multiprocessing.Queue()
+	inboxes = [multiprocessing.Queue() for _ in range(islands)]
+	processes = [
+		multiprocessing.Process(
+			target=island_worker,
+			args=(
+				i, base_layouts, elites_len, max_population, max_generation, gen_by_target, plateau,
+				inboxes[i], inboxes[(i+1) % islands], report, random.getrandbits(64), island_states[i],
+			),
+			daemon=True,
+		)
+		for i in range(islands)
+	]
+	for p in processes:
+		p.start()
+
+	try:
+		gens = [0] * islands
+		running = islands
+		prev = [l.total for l in elites]
+		saved = time.monotonic()
+		finished = [False] * islands
+		while running:
+			try:
+				kind, i, gen, layouts, island_state = report.get(timeout=1)
+			except queue.Empty:
+				# an island that raised never posts 'done'; a clean exit always has, so only a failure counts
+				for i, p in enumerate(processes):
+					if not finished[i] and p.exitcode not in (None, 0):
+						print(f'\r\033[KIsland {i} died (exit code {p.exitcode})')
+						finished[i] = True
+						running -= 1
+				continue
+			if kind == 'done':
+				finished[i] = True
+				running -= 1
+			gens[i] = gen
+			island_states[i] = island_state
+			print(f'\r\033[K...{sum(gens)}/{max_generation*islands}', end='')
+
+			elites = sort_unique_layouts(elites + layouts, elites_len)
+			totals = [l.total for l in elites]
+			if prev != totals:
+				if prev[0] != totals[0]:
+					print(f'\t improved ({prev[0]:,} -> {totals[0]:,}) on island {i}')
+				prev = totals
+				save_result(elites, result_path)
+
+			if time.monotonic() - saved >= CHECKPOINT_INTERVAL:
+				save_checkpoint(result_path, 'island', state())
+				saved = time.monotonic()
+	finally:
+		for p in processes:
+			if p.is_alive():
+				p.terminate()
+			p.join()
+
+	save_result(elites, result_path)
+	if budget_exhausted():
+		save_checkpoint(result_path, 'island', state())
+	else:
+		remove_checkpoint(result_path, 'island')
+	return elites
+
+def island_worker(index, base_layouts, elites_len, max_population, max_generation, gen_by_target, plateau,
+		inbox, outbox, report, seed, state=None, migration_interval=5, migrants_len=2):
+	reset_evaluations()
+	# migrants left unread when the neighbour finishes first must not block exit
+	outbox.cancel_join_thread()
+
+	def run_workers(tasks, progress, result_len):
+		return map(optimize_worker, tasks, [progress] * len(tasks), [result_len] * len(tasks))
+
+	if state is None:
+		random.seed(seed)
+		elites = [l.clone() for l in base_layouts[:elites_len]]
+		population = init_population(base_layouts, max_population)
+		prev = elites[0].total
+		gen = 1
+		stale = 0
+		step = 0
+	else:
+		population, elites = state['population'], state['elites']
+		prev, gen, stale, step = state['prev'], state['gen'], state['stale'], state['step']
+		random.setstate(state['rng'])
+
+	def island_state():
+		return {
+			'population': population, 'elites': elites,
+			'prev': prev, 'gen': gen, 'stale': stale, 'step': step,
+			'rng': random.getstate(),
+		}
+
+	while gen <= max_generation and (plateau is None or stale < plateau) and not budget_exhausted():
+		target = gen // gen_by_target + 1
+		progress = min(gen/max_generation, 1.0)
+		population, elites = evolve(population, elites, target, progress, max_population, elites_len, run_workers)
+		flush_evaluations()
+
+		step += 1
+		if step % migration_interval == 0:
+			outbox.put(elites[:migrants_len])
+		migrants = []
+		while not inbox.empty():
+			try:
+				migrants.extend(inbox.get_nowait())
+			except queue.Empty:
+				break
+		if migrants:
+			population = sort_unique_layouts(population + migrants, max_population)
+			elites = sort_unique_layouts(elites + migrants, elites_len)
+
+		target_total = elites[target-1].total if len(elites) >= target else elites[-1].total
+		if prev != target_total:
+			prev = target_total
+			stale = 0
+		else:
+			gen += 1
+			stale += 1
+		report.put(('elites', index, gen - 1, elites, island_state()))
+
+	report.put(('done', index, gen - 1, elites, island_state()))
+
+def optimize_tempering(base_layouts: list[Layout], result_path, elites_len=5, replicas=None,
+		steps=2000, plateau=None, checkpoint=None):
+	plateau = plateau or 20
+	if checkpoint is None:
+		replicas = replicas or max(4, os.cpu_count() or 1)
+		max_temp = max(abs(base_layouts[0].total) * 0.005, 50)
+		min_temp = max_temp * 1e-4
+		# geometric ladder, coldest first
+		temps = [min_temp * ((max_temp / min_temp) ** (i / max(1, replicas - 1))) for i in range(replicas)]
+		chains = [base_layouts[i % len(base_layouts)].clone() for i in range(replicas)]
+		elites = [l.clone() for l in base_layouts[:elites_len]]
+		prev = [l.total for l in elites]
+		stale = 0
+		rounds = 0
+	else:
+		temps, chains, elites = checkpoint['temps'], checkpoint['chains'], checkpoint['elites']
+		prev, stale, rounds = checkpoint['prev'], checkpoint['stale'], checkpoint['rounds']
+		random.setstate(checkpoint['rng'])
+		replicas = len(chains)
+		max_temp = temps[-1]
+		print(f'[Resume] round {rounds}')
+
+	def state():
+		return {
+			'temps': temps, 'chains': chains, 'elites': elites,
+			'prev': prev, 'stale': stale, 'rounds': rounds,
+			'rng': random.getstate(),
+		}
+
+	with ProcessPoolExecutor(initializer=reset_evaluations) as executor:
+		saved = time.monotonic()
+		while stale < plateau and not budget_exhausted():
+			rounds += 1
+			print(f'\r\033[K...{rounds} ({stale}/{plateau})', end='')
+			result = list(executor.map(
+				tempering_worker,
+				chains,
+				temps,
+				[max_temp] * replicas,
+				[steps] * replicas,
+				[random.getrandbits(64) for _ in range(replicas)],
+			))
+			chains = [chain for chain, _ in result]
+			flush_evaluations()
+
+			# Replica exchange between neighbouring temperatures, alternating even and odd pairs
+			for i in range(rounds % 2, replicas - 1, 2):
+				a, b = chains[i], chains[i+1]
+				delta = (1/temps[i] - 1/temps[i+1]) * (b.total - a.total)
+				if delta >= 0 or math.exp(delta) > random.random():
+					chains[i], chains[i+1] = b, a
+
+			elites = sort_unique_layouts(elites + [best for _, best in result], elites_len)
+			totals = [l.total for l in elites]
+			if prev != totals:
+				if prev[0] != totals[0]:
+					print(f'\t improved ({prev[0]:,} -> {totals[0]:,})')
+				prev = totals
+				save_result(elites, result_path)
+				stale = 0
+			else:
+				stale += 1
+
+			if time.monotonic() - saved >= CHECKPOINT_INTERVAL:
+				save_checkpoint(result_path, 'tempering', state())
+				saved = time.monotonic()
+
+	save_result(elites, result_path)
+	if budget_exhausted():
+		save_checkpoint(result_path, 'tempering', state())
+	else:
+		remove_checkpoint(result_path, 'tempering')
+	return elites
+
+def tempering_worker(layout: Layout, temperature, max_temp, steps, seed):
+	random.seed(seed)
+	best = layout.clone()
+	for _ in range(steps):
+		if budget_exhausted():
+			break
+		diff, undo = optimize_swap(layout, temperature, max_temp)
+		if diff >= 0 or math.exp(diff / temperature) > random.random():
+			if layout.total > best.total:
+				best = layout.clone()
+				best.source += '->pt'
+		else:
+			layout.restore(undo)
+	flush_evaluations()
+	return layout, best
+
+def optimize_tabu_search(base_layouts: list[Layout], result_path, elites_len=5, steps=200, tenure=None,
+		aspiration=None, plateau=None, checkpoint=None):
+	plateau = plateau or 10
+	tasks_len = os.cpu_count() or 1
+	if checkpoint is None:
+		elites = [l.clone() for l in base_layouts[:elites_len]]
+		prev = [l.total for l in elites]
+		stale = 0
+		rounds = 0
+	else:
+		elites = checkpoint['elites']
+		prev, stale, rounds = checkpoint['prev'], checkpoint['stale'], checkpoint['rounds']
+		random.setstate(checkpoint['rng'])
+		print(f'[Resume] round {rounds}')
+
+	def state():
+		return {'elites': elites, 'prev': prev, 'stale': stale, 'rounds': rounds, 'rng': random.getstate()}
+
+	with ProcessPoolExecutor(initializer=reset_evaluations) as executor:
+		saved = time.monotonic()
+		while stale < plateau and not budget_exhausted():
+			rounds += 1
+			print(f'\r\033[K...{rounds} ({stale}/{plateau})', end='')
+
+			# one search from each elite as is, the rest from elites kicked by a few random swaps
+			starts = []
+			for i in range(tasks_len):
+				layout = elites[i % len(elites)].clone()
+				if i >= len(elites):
+					optimize_swap(layout, 0, 1, fix=4)
+				starts.append(layout)
+			result = executor.map(
+				tabu_worker,
+				starts,
+				[elites_len] * tasks_len,
+				[steps] * tasks_len,
+				[tenure] * tasks_len,
+				[aspiration] * tasks_len,
+				[random.getrandbits(64) for _ in range(tasks_len)],
+			)
+			for r in result:
+				elites = sort_unique_layouts(elites + r, elites_len)
+			flush_evaluations()
+
+			totals = [l.total for l in elites]
+			if prev != totals:
+				if prev[0] != totals[0]:
+					print(f'\t improved ({prev[0]:,} -> {totals[0]:,})')
+				prev = totals
+				save_result(elites, result_path)
+				stale = 0
+			else:
+				stale += 1
+
+			if time.monotonic() - saved >= CHECKPOINT_INTERVAL:
+				save_checkpoint(result_path, 'tabu', state())
+				saved = time.monotonic()
 
+	save_result(elites, result_path)
+	if budget_exhausted():
+		save_checkpoint(result_path, 'tabu', state())
+	else:
+		remove_checkpoint(result_path, 'tabu')
 	return elites
 
-def optimize_worker(layout: Layout, progress, result_len):
-	sa_weight = 0.2 + 0.2 * progress   # 0.2 - 0.4
+def tabu_worker(layout: Layout, result_len, steps, tenure, aspiration, seed):
+	random.seed(seed)
+	result = optimize_tabu(layout, result_len, max_iter=steps, tenure=tenure, aspiration=aspiration)
+	flush_evaluations()
+	return result
+
+def optimize_worker(layout: Layout, progress, result_len, seed=None):
+	# tasks still queued at the deadline pass their layout through
+	if budget_exhausted():
+		return [layout]
+	if seed is not None:
+		random.seed(seed)
+	sa_weight = 0.15 + 0.15 * progress   # 0.15 - 0.3
+	tabu_weight = 0.05 + 0.05 * progress   # 0.05 - 0.1
 	effort_weight = 0.2 + 0.1 * progress  # 0.2 - 0.3
 	swap_weight = 0.3 - 0.05 * progress  # 0.3 - 0.25
-	pass_weight = 1.0 - (sa_weight + effort_weight + swap_weight)
+	pass_weight = 1.0 - (sa_weight + tabu_weight + effort_weight + swap_weight)
 
-	weights = [max(0.0, sa_weight), max(0.0, effort_weight), max(0.0, swap_weight), max(0.0, pass_weight)]
+	weights = [
+		max(0.0, sa_weight), max(0.0, tabu_weight), max(0.0, effort_weight),
+		max(0.0, swap_weight), max(0.0, pass_weight),
+	]
 
 	total = sum(weights)
 	if total <= 0:
-		weights = [0.25] * 4
+		weights = [0.2] * 5
 		total = 1.0
 	thresholds = []
 	acc = 0.0
@@ -924,13 +2905,18 @@ def optimize_worker(layout: Layout, progress, result_len):
 
 	r = random.random()
 	if r < thresholds[0]:
-		return optimize_sa(layout, result_len)
+		result = optimize_sa(layout, result_len)
 	elif r < thresholds[1]:
-		return optimize_effort(layout, result_len)
+		# a short run: one full-neighbourhood step costs about as much as a hundred swaps
+		result = optimize_tabu(layout, result_len, max_iter=25)
 	elif r < thresholds[2]:
-		return optimize_shuffle(layout, result_len)
+		result = optimize_effort(layout, result_len)
+	elif r < thresholds[3]:
+		result = optimize_shuffle(layout, result_len)
 	else:
-		return [layout]
+		result = [layout]
+	flush_evaluations()
+	return result
 
 def print_layout(layout: Layout):
 	print(f'{layout.score.effort:,.0f}\t', end='')
@@ -963,46 +2949,97 @@ def load_result(result_path):
 		layouts.append(Layout([literal_eval(l) for l in lines[i+1:i+4]], source=lines[i]))
 	return layouts
 
+def make_parser():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('result_path')
+	parser.add_argument('custom', nargs='*', metavar='[custom_index] custom_letters')
+	parser.add_argument('--mode', choices=('ga', 'island', 'tempering', 'tabu'), default='ga',
+		help='ga: one population farmed out to a process pool; island: one population per process with migration; '
+			'tempering: parallel tempering over a ladder of annealing replicas; '
+			'tabu: robust tabu search restarted from the elites')
+	parser.add_argument('--islands', type=int, default=None, help='number of islands (default: cpu count)')
+	parser.add_argument('--replicas', type=int, default=None, help='number of tempering replicas (default: cpu count, at least 4)')
+	parser.add_argument('--tabu-steps', type=int, default=200, help='tabu search steps per restart')
+	parser.add_argument('--tabu-tenure', type=int, nargs=2, default=None, metavar=('MIN', 'MAX'),
+		help='range the tabu tenure is drawn from (default: 0.9 to 1.1 times the number of keys)')
+	parser.add_argument('--tabu-aspiration', type=int, default=None, metavar='STEPS',
+		help='force a move whose letters have not been on its keys for this many steps (default: twice the keys squared)')
+	parser.add_argument('--time', type=float, default=None, metavar='SECONDS', help='stop searching after this wall-clock time')
+	parser.add_argument('--evals', type=int, default=None, help='stop searching after this many layout evaluations (full or per swap)')
+	parser.add_argument('--plateau', type=int, default=None, metavar='GENERATIONS',
+		help='stop after this many generations (tempering: rounds) without improvement')
+	parser.add_argument('--fresh', action='store_true', help='ignore any checkpoint and start a new search')
+	parser.add_argument('--refetch', action='store_true', help='analyze again if targets failed to fetch last time')
+	parser.add_argument('--seed', type=int, default=None,
+		help='seed the search; worker tasks draw their seeds from it, so a run without a time or evaluation budget repeats (island mode aside)')
+	return parser
+
+def run_search(args, result, result_path, checkpoint=None):
+	if args.seed is not None and checkpoint is None:
+		random.seed(args.seed)
+	init_budget(args.time, args.evals)
+	if args.mode == 'island':
+		return optimize_islands(result, result_path, islands=args.islands, plateau=args.plateau, checkpoint=checkpoint)
+	elif args.mode == 'tempering':
+		return optimize_tempering(result, result_path, replicas=args.replicas, plateau=args.plateau, checkpoint=checkpoint)
+	elif args.mode == 'tabu':
+		return optimize_tabu_search(
+			result, result_path, steps=args.tabu_steps, tenure=args.tabu_tenure,
+			aspiration=args.tabu_aspiration, plateau=args.plateau, checkpoint=checkpoint,
+		)
+	else:
+		return optimize(result, result_path, plateau=args.plateau, checkpoint=checkpoint)
+
 if __name__ == '__main__':
 	multiprocessing.set_start_method("fork")
 	signal.signal(signal.SIGINT, cleanup)
 	try:
-		if len(sys.argv) < 2:
-			print(f"Usage: {sys.argv[0]} <result_path> [custom_index] [custom_letters]")
-			sys.exit(1)
+		parser = make_parser()
+		args = parser.parse_args()
+		if len(args.custom) > 2:
+			parser.error('expected at most [custom_index] custom_letters')
 
-		result_path = sys.argv[1]
+		result_path = args.result_path
 		result_path = os.path.expanduser(result_path)
 		result_path = os.path.abspath(result_path)
 		os.makedirs(result_path, exist_ok=True)
 
 		# Analyze
-		file_path = os.path.join(result_path, ANALYZE_RESULT_FILENAME)
-		if os.path.exists(file_path):
-			load_analysis_result(result_path)
-		else:
+		# results without a corpus key predate the count cache and are kept as is
+		file_paths = [os.path.join(result_path, f) for f in (ANALYZE_BINARY_FILENAME, ANALYZE_RESULT_FILENAME)]
+		failed = load_failed_targets(result_path)
+		if not any(os.path.exists(f) for f in file_paths) or \
+				load_analysis_result(result_path) not in (None, corpus_key(load_targets(result_path))) or \
+				(args.refetch and failed):
 			analyze_target(result_path)
-
-		init_score_state()
+		elif failed:
+			print(f'Corpus is missing {len(failed)} target(s) that failed to fetch ({", ".join(failed)}); --refetch retries them')
+
+		# a checkpoint carries its own score state, so resuming skips init_score_state
+		checkpoint = None
+		if not args.custom and not args.fresh:
+			checkpoint = load_checkpoint(result_path, args.mode)
+		if checkpoint is None:
+			init_score_state(result_path)
 		file_path = os.path.join(result_path, RESULT_FILENAME)
 		if os.path.exists(file_path):
 			result = load_result(result_path)
 		else:
 			result = [make_initial_layout()]
 
-		if len(sys.argv) >= 3:
-			if len(sys.argv) == 3:
+		if args.custom:
+			if len(args.custom) == 1:
 				index = 0
-				letters = sys.argv[2]
+				letters = args.custom[0]
 			else:
-				index = int(sys.argv[2])
-				letters = sys.argv[3]
+				index = int(args.custom[0])
+				letters = args.custom[1]
 			if letters != '':
 				result = optimize_shuffle(result[index], len(letters), len(letters), letters)
 		else:
 			# Optimize
 			print(f'[Optimize]')
-			result = optimize(result, result_path)
+			result = run_search(args, result, result_path, checkpoint)
 			print(f'\r\033[K...Done')
 
 		for i, l in enumerate(result, 1):
@@ -0,0 +1,172 @@
+#!/usr/bin/env pypy3
+# pyright: basic
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import shlex
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import optimize as o
+import bench
+
+CONFIGS = {
+	'ga': '--mode ga',
+	'island': '--mode island',
+	'tempering': '--mode tempering',
+	'tabu': '--mode tabu',
+}
+SEEDS = [1, 2, 3, 4, 5]
+TIME_BUDGET = 30
+SCORE_STATE_SEED = 0
+CURVE_POINTS = (0.1, 0.25, 0.5, 1.0)
+
+def prepare_corpus(corpus_path, result_path):
+	# a result directory to take analyze_result.bin/tsv from, or the benchmark's synthetic corpus
+	if corpus_path:
+		for name in (o.ANALYZE_BINARY_FILENAME, o.ANALYZE_RESULT_FILENAME):
+			file_path = os.path.join(corpus_path, name)
+			if os.path.exists(file_path):
+				shutil.copy(file_path, result_path)
+	else:
+		text_path = os.path.join(result_path, 'corpus')
+		os.makedirs(text_path)
+		bench.analyze_corpus(bench.make_corpus(text_path), result_path)
+	o.load_analysis_result(result_path)
+
+def run(options, seed, base_layouts, run_path, budget_time, budget_evals):
+	argv = [run_path, *shlex.split(options), '--seed', str(seed)]
+	if budget_time is not None:
+		argv += ['--time', str(budget_time)]
+	if budget_evals is not None:
+		argv += ['--evals', str(budget_evals)]
+	args = o.make_parser().parse_args(argv)
+	os.makedirs(run_path)
+
+	# every mode saves its elites on each improvement, which is where the curve is sampled
+	curve = [(0.0, 0, max(l.total for l in base_layouts))]
+	save_result = o.save_result
+	def record(layouts, result_path):
+		curve.append((time.monotonic() - start, o.EVAL_COUNT.value + o.EVALS, max(l.total for l in layouts)))
+		save_result(layouts, result_path)
+
+	o.save_result = record
+	try:
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			start = time.monotonic()
+			o.run_search(args, [l.clone() for l in base_layouts], run_path)
+	finally:
+		o.save_result = save_result
+	return curve
+
+def best_at(curve, axis, x, budget):
+	# the last generation or round, and the final save, land just past the budget and count as at it
+	best = curve[0][2]
+	for point in curve:
+		if min(point[axis], budget) > x:
+			break
+		best = max(best, point[2])
+	return best
+
+def reached_at(curve, axis, target):
+	for point in curve:
+		if point[2] >= target:
+			return point[axis]
+	return None
+
+def summarize(runs, axis, budget):
+	finals = [curve[-1][2] for curves in runs.values() for curve in curves.values()]
+	# a total every run reaches, so the time (or evaluations) to get there compares every configuration
+	target = min(finals)
+	summary = {}
+	for name, curves in runs.items():
+		points = {}
+		for fraction in CURVE_POINTS:
+			values = [best_at(curve, axis, budget * fraction, budget) for curve in curves.values()]
+			points[fraction] = {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+		reached = [reached_at(curve, axis, target) for curve in curves.values()]
+		summary[name] = {
+			'points': points,
+			'final_mean': statistics.mean(curve[-1][2] for curve in curves.values()),
+			'reach_target_median': statistics.median(reached),
+		}
+	return target, summary
+
+def print_summary(target, summary, axis):
+	unit = 's' if axis == 0 else ' evals'
+	header = ''.join(f'{f"@{fraction:.0%}":>16}' for fraction in CURVE_POINTS)
+	print(f'{"config":<16}{header}{"final mean":>18}{"reach":>14}')
+	for name, s in summary.items():
+		cells = ''.join(f'{s["points"][fraction]["median"]:>16,.0f}' for fraction in CURVE_POINTS)
+		reach = s['reach_target_median']
+		reach = f'{reach:,.1f}{unit}' if axis == 0 else f'{reach:,.0f}{unit}'
+		print(f'{name:<16}{cells}{s["final_mean"]:>18,.0f}{reach:>14}')
+	print(f'median best total over seeds at each fraction of the budget; reach: median to {target:,}')
+
+def main():
+	parser = argparse.ArgumentParser(description='best total over time for optimize.py configurations under fixed seeds')
+	parser.add_argument('--config', action='append', default=None, metavar='NAME=OPTIONS',
+		help=f'a configuration as optimize.py options, e.g. "tabu50=--mode tabu --tabu-steps 50" (default: {", ".join(CONFIGS)})')
+	parser.add_argument('--seeds', type=int, nargs='+', default=SEEDS, help='seeds every configuration is run with')
+	parser.add_argument('--time', type=float, default=None, metavar='SECONDS', help=f'time budget per run (default: {TIME_BUDGET})')
+	parser.add_argument('--evals', type=int, default=None, help='evaluation budget per run; curves are then over evaluations')
+	parser.add_argument('--corpus', default=None, metavar='RESULT_PATH',
+		help='result directory whose analyze_result is used (default: the synthetic benchmark corpus)')
+	parser.add_argument('--output', default=None, metavar='FILE', help='write the curves and the summary as json')
+	args = parser.parse_args()
+
+	configs = CONFIGS
+	if args.config:
+		configs = {}
+		for config in args.config:
+			name, sep, options = config.partition('=')
+			if not sep:
+				parser.error(f'expected NAME=OPTIONS, got {config}')
+			configs[name] = options
+	budget_time = args.time if args.time is not None or args.evals is not None else TIME_BUDGET
+	axis, budget = (1, args.evals) if args.evals is not None else (0, budget_time)
+
+	multiprocessing.set_start_method('fork')
+
+	with tempfile.TemporaryDirectory() as tmp_path:
+		corpus_path = os.path.join(tmp_path, 'corpus')
+		os.makedirs(corpus_path)
+		prepare_corpus(args.corpus, corpus_path)
+		# the same score normalisation and starting layout for every run
+		random.seed(SCORE_STATE_SEED)
+		o.init_score_state()
+		base_layouts = [o.make_initial_layout()]
+
+		runs = {}
+		for name, options in configs.items():
+			runs[name] = {}
+			for seed in args.seeds:
+				run_path = os.path.join(tmp_path, f'{name}_{seed}')
+				curve = run(options, seed, base_layouts, run_path, budget_time, args.evals)
+				runs[name][seed] = curve
+				print(f'{name} seed {seed}: {curve[-1][2]:,} after {curve[-1][0]:.1f}s, {curve[-1][1]:,} evals')
+
+	target, summary = summarize(runs, axis, budget)
+	print()
+	print_summary(target, summary, axis)
+
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as f:
+			json.dump({
+				'configs': configs, 'seeds': args.seeds,
+				'budget': {'time': budget_time, 'evals': args.evals},
+				'curves': {name: {str(seed): curve for seed, curve in curves.items()} for name, curves in runs.items()},
+				'target': target,
+				'summary': {name: {**s, 'points': {str(k): v for k, v in s['points'].items()}} for name, s in summary.items()},
+			}, f, indent=1)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())